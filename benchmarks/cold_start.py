@@ -0,0 +1,56 @@
+"""
+Cold start cost of the lambda handler modules: time and peak RSS of importing each of them in a fresh
+Python process, which is the work done by the Lambda init phase.
+
+    python -m benchmarks.cold_start --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.run import LAMBDAS_FOLDER
+
+HANDLERS = ["email_filtering", "email_processing", "curated_compaction"]
+
+MEASURE_IMPORT = """
+import json, os, resource, sys, time
+sys.path.insert(0, {folder!r})
+os.environ.update({environment!r})
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"import_ms": (time.perf_counter() - start) * 1000,
+                  "modules": len(sys.modules),
+                  "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+def measure_import(module, folder):
+    environment = {"AWS_DEFAULT_REGION": "us-east-1", "BUCKET_NAME": "benchmark",
+                   "CONFIG_PARSER_KEY": "config/email.json"}
+    completed = subprocess.run([sys.executable, "-c", MEASURE_IMPORT.format(folder=folder, module=module,
+                                                                            environment=environment)],
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--handlers", nargs="+", default=HANDLERS)
+    parser.add_argument("--lambdas-folder", default=LAMBDAS_FOLDER,
+                        help="folder of the handler modules, to compare with another version of them")
+    arguments = parser.parse_args()
+
+    print("handler              import_p50_ms  modules  peak_rss_mb")
+    for module in arguments.handlers:
+        runs = [measure_import(module, os.path.abspath(arguments.lambdas_folder)) for _ in range(arguments.runs)]
+        print(f"{module:<20} {statistics.median(run['import_ms'] for run in runs):>13.1f}  "
+              f"{runs[-1]['modules']:>7}  {max(run['peak_rss_mb'] for run in runs):>11.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import io
+import random
+from email import charset
+from email.message import EmailMessage
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import openpyxl  # type: ignore
+
+SENDER = "trusted_emails@server.com"
+RECIPIENT = "email_you_own@server.com"
+
+# name => attachments of the synthetic emails, each attachment is (kind, rows, encoding)
+#   kind: csv or xlsx, encoding: base64 or quoted-printable for csv (xlsx are always base64)
+SCENARIOS = {
+    "no_attachment": [],
+    "small_csv": [("csv", 1000, "base64")],
+    "multi_csv": [("csv", 5000, "base64")] * 5,
+    "large_csv": [("csv", 200000, "base64")],
+    "latin1_quoted_printable_csv": [("csv", 20000, "quoted-printable")],
+    "xlsx": [("xlsx", 20000, "base64")],
+    "mixed": [("csv", 20000, "base64"), ("xlsx", 5000, "base64"), ("pdf", 0, "base64")],
+}
+
+
+def csv_bytes(rows, seed, encoding='utf-8'):
+    generator = random.Random(seed)
+    lines = ["id,label,amount,ratio,day"]
+    for row in range(rows):
+        lines.append(f"{row},label_{generator.randint(0, 50)},{generator.randint(-10 ** 6, 10 ** 6)},"
+                     f"{generator.random():.6f},2021-01-{generator.randint(1, 28):02d}")
+    # a few non ascii labels so that the encodings matter
+    lines.append(f"{rows},étiquette_ü,0,0.0,2021-01-01")
+    return ("\n".join(lines) + "\n").encode(encoding)
+
+
+def xlsx_bytes(rows, seed):
+    generator = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("data")
+    sheet.append(["id", "label", "amount", "ratio"])
+    for row in range(rows):
+        sheet.append([row, f"label_{generator.randint(0, 50)}", generator.randint(-10 ** 6, 10 ** 6), generator.random()])
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def csv_part(rows, seed, encoding, filename):
+    if encoding == "quoted-printable":
+        latin1 = charset.Charset('latin-1')
+        latin1.body_encoding = charset.QP
+        part = MIMEText(csv_bytes(rows, seed, 'latin-1').decode('latin-1'), 'csv', latin1)
+    else:
+        part = MIMEApplication(csv_bytes(rows, seed), 'csv')
+        part.replace_header('Content-Type', 'text/csv')
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+    return part
+
+
+def build_email(attachments, seed=0):
+    """Raw bytes of a synthetic email with the given attachments, contents vary with `seed`"""
+    if not attachments:
+        message = EmailMessage()
+        message.set_content("No attachment in this one")
+    else:
+        message = MIMEMultipart()
+        message.attach(MIMEText("Please find the files attached"))
+        for index, (kind, rows, encoding) in enumerate(attachments):
+            filename = f"report_{index}.{kind}"
+            if kind == "csv":
+                part = csv_part(rows, seed + index, encoding, filename)
+            elif kind == "xlsx":
+                part = MIMEApplication(xlsx_bytes(rows, seed + index),
+                                       'vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+                part.add_header('Content-Disposition', 'attachment', filename=filename)
+            else:
+                part = MIMEApplication(b'%PDF-1.4 synthetic', kind)
+                part.add_header('Content-Disposition', 'attachment', filename=filename)
+            message.attach(part)
+    message['From'] = f"Trusted Partner <{SENDER}>"
+    message['To'] = RECIPIENT
+    message['Subject'] = f"Synthetic report {seed}"
+    message['Date'] = "Mon, 11 Jan 2021 08:29:38 +0100"
+    return message.as_bytes()
+
+
+def ses_event(source, message_id="synthetic"):
+    """Minimal SES receipt event, as sent to the email_filtering lambda"""
+    return {
+        "Records": [{
+            "eventSource": "aws:ses",
+            "ses": {
+                "mail": {
+                    "source": source,
+                    "messageId": message_id,
+                    "destination": [RECIPIENT],
+                    "headers": [{"name": "From", "value": source},
+                                {"name": "Content-Type", "value": "multipart/mixed; boundary=synthetic"}],
+                    "commonHeaders": {"from": [source], "to": [RECIPIENT]},
+                },
+                "receipt": {"recipients": [RECIPIENT],
+                            "spamVerdict": {"status": "PASS"}, "virusVerdict": {"status": "PASS"},
+                            "spfVerdict": {"status": "PASS"}, "dkimVerdict": {"status": "PASS"}},
+            },
+        }]
+    }
@@ -0,0 +1,213 @@
+"""
+Offline benchmark of the email_processing and email_filtering lambda handlers.
+
+The handlers run against moto's in-process S3 and Glue, with synthetic emails from benchmarks/corpus.py.
+Each scenario runs in its own Python process so that its peak RSS is not polluted by the others.
+
+    python -m benchmarks.run                       # all the scenarios
+    python -m benchmarks.run --scenarios small_csv xlsx --iterations 20
+    python -m benchmarks.run --output results.json --baseline previous.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.corpus import SCENARIOS, SENDER, build_email, ses_event
+
+LAMBDAS_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'lambdas')
+BUCKET_NAME = "email-integration-benchmark"
+CONFIG_PARSER_KEY = "config/email.json"
+# allow-list sizes of the email_filtering scenarios
+FILTERING_SCENARIOS = {"filtering_10_senders": 10, "filtering_5000_senders": 5000}
+
+LAMBDA_ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "BUCKET_NAME": BUCKET_NAME,
+    "CONFIG_PARSER_KEY": CONFIG_PARSER_KEY,
+    "GLUE_DATABASE_NAME": "database_email_integration",
+    "S3_PREFIX_RAW": "tooling",
+    "S3_PREFIX_QUARANTINE": "quarantine_email",
+    "S3_PREFIX_CURATED": "curated_emails",
+    "POSSIBLE_EXTENSION_FILE": "csv, xls, xlsx",
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def setup_aws(accepted_senders):
+    import boto3  # type: ignore
+    s3_client = boto3.client('s3')
+    s3_client.create_bucket(Bucket=BUCKET_NAME)
+    boto3.client('glue').create_database(DatabaseInput={'Name': LAMBDA_ENVIRONMENT['GLUE_DATABASE_NAME']})
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=CONFIG_PARSER_KEY, Body=json.dumps({
+        "ACCEPTED_SENDERS": ",".join(accepted_senders),
+        "S3_PREFIX_QUARANTINE": LAMBDA_ENVIRONMENT["S3_PREFIX_QUARANTINE"],
+        "S3_PREFIX_CURATED": LAMBDA_ENVIRONMENT["S3_PREFIX_CURATED"],
+    }).encode('utf-8'))
+    return s3_client
+
+
+class CriticalLogCounter(logging.Handler):
+    """Count the critical logs of the handlers: failed or quarantined attachments and rejected senders"""
+
+    def __init__(self):
+        super().__init__(level=logging.CRITICAL)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def measure(prepare, iterations):
+    """
+    `prepare(iteration)` sets up one invocation and returns the call to time.
+    Returns the latencies and CPU times of the calls in milliseconds.
+    """
+    latencies, cpu_times = [], []
+    for iteration in range(iterations):
+        call = prepare(iteration)
+        cpu_start, start = cpu_seconds(), time.perf_counter()
+        # the EMF records printed by the handlers are part of the cost but not of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            call()
+        latencies.append((time.perf_counter() - start) * 1000)
+        cpu_times.append((cpu_seconds() - cpu_start) * 1000)
+    return latencies, cpu_times
+
+
+def run_processing_scenario(name, iterations):
+    s3_client = setup_aws([SENDER])
+    import email_processing  # type: ignore
+    raw_emails = [build_email(SCENARIOS[name], seed=iteration * 100) for iteration in range(iterations)]
+
+    def prepare(iteration):
+        key = f"{LAMBDA_ENVIRONMENT['S3_PREFIX_RAW']}/{name}-{iteration}"
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=key, Body=raw_emails[iteration])
+        event = {"Records": [{"s3": {"bucket": {"name": BUCKET_NAME}, "object": {"key": key}}}]}
+        return lambda: email_processing.lambda_handler(event, None)
+
+    latencies, cpu_times = measure(prepare, iterations)
+    return latencies, cpu_times, sum(len(raw_email) for raw_email in raw_emails) / iterations
+
+
+def run_filtering_scenario(name, iterations):
+    accepted_senders = [f"partner_{index}@domain{index}.com" for index in range(FILTERING_SCENARIOS[name] - 1)]
+    setup_aws(accepted_senders + [SENDER])
+    import email_filtering  # type: ignore
+    sources = [SENDER, "unknown@spam.com"]
+
+    def prepare(iteration):
+        event = ses_event(sources[iteration % len(sources)])
+        return lambda: email_filtering.lambda_handler(event, None)
+
+    latencies, cpu_times = measure(prepare, iterations)
+    return latencies, cpu_times, 0
+
+
+def run_scenario(name, iterations):
+    """Run one scenario in the current process and return its report"""
+    os.environ.update(LAMBDA_ENVIRONMENT)
+    sys.path.insert(0, LAMBDAS_FOLDER)
+    from moto import mock_aws  # type: ignore
+    critical_logs = CriticalLogCounter()
+    logging.getLogger().addHandler(critical_logs)
+    with mock_aws():
+        if name in FILTERING_SCENARIOS:
+            latencies, cpu_times, email_size = run_filtering_scenario(name, iterations)
+        else:
+            latencies, cpu_times, email_size = run_processing_scenario(name, iterations)
+    return {
+        "scenario": name,
+        "iterations": iterations,
+        "critical_logs": critical_logs.count,
+        "email_bytes": int(email_size),
+        "throughput_per_second": round(1000 * iterations / sum(latencies), 2),
+        "p50_ms": round(percentile(latencies, 0.5), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "cpu_p50_ms": round(statistics.median(cpu_times), 2),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_isolated(name, iterations):
+    completed = subprocess.run([sys.executable, "-m", "benchmarks.run", "--in-process", "--scenarios", name,
+                                "--iterations", str(iterations)],
+                               capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if completed.returncode != 0:
+        raise RuntimeError(f"scenario {name} failed:\n{completed.stderr[-4000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(reports, baseline_path, tolerance):
+    """Return the scenarios whose p50 latency or peak RSS grew by more than `tolerance` against the baseline"""
+    with open(baseline_path) as baseline_file:
+        baseline = {report["scenario"]: report for report in json.load(baseline_file)}
+    regressions = []
+    for report in reports:
+        previous = baseline.get(report["scenario"])
+        if previous is None:
+            continue
+        for metric in ("p50_ms", "peak_rss_mb"):
+            if report[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{report['scenario']} {metric}: {previous[metric]} -> {report[metric]}")
+    return regressions
+
+
+def print_table(reports):
+    columns = ["scenario", "iterations", "critical_logs", "email_bytes", "throughput_per_second", "p50_ms", "p99_ms",
+               "cpu_p50_ms", "peak_rss_mb"]
+    widths = [max(len(column), *(len(str(report[column])) for report in reports)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for report in reports:
+        print("  ".join(str(report[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS) + list(FILTERING_SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--output", help="write the reports to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed growth against the baseline")
+    parser.add_argument("--in-process", action="store_true", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.in_process:
+        print(json.dumps(run_scenario(arguments.scenarios[0], arguments.iterations)))
+        return 0
+
+    reports = [run_isolated(name, arguments.iterations) for name in arguments.scenarios]
+    print_table(reports)
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(reports, output_file, indent=2)
+    if arguments.baseline:
+        regressions = compare(reports, arguments.baseline, arguments.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
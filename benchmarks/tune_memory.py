@@ -0,0 +1,90 @@
+"""
+Recommend the memory of the small, medium and large email_processing lambdas from the benchmark corpus.
+
+Each scenario is replayed with benchmarks/run.py, or read from the JSON output of a previous run, and routed to
+a tier as email_routing would. Its duration at each Lambda memory size is then modelled from the measured
+latency and CPU time: Lambda allocates CPU in proportion to memory, one full vCPU at 1769 MB, so the CPU time
+stretches below it while the time spent waiting on S3 and Glue does not change. A memory size is feasible when
+it holds the measured peak RSS with `--headroom`; that RSS includes moto, so it errs on the safe side.
+The recommendation is the cheapest feasible size whose duration is within `--max-slowdown` of the fastest one.
+
+    python -m benchmarks.tune_memory --iterations 5
+    python -m benchmarks.tune_memory --input results.json
+"""
+import argparse
+import json
+import os
+import sys
+
+from benchmarks.corpus import SCENARIOS
+from benchmarks.run import LAMBDAS_FOLDER, run_isolated
+
+MEMORY_SIZES_MB = [512, 1024, 1536, 1769, 2048, 3008, 4096, 6144, 8192, 10240]
+FULL_VCPU_MEMORY_MB = 1769
+# x86 on-demand prices of us-east-1
+GB_SECOND_PRICE = 0.0000166667
+REQUEST_PRICE = 0.0000002
+
+
+def scenario_tier(report):
+    sys.path.insert(0, LAMBDAS_FOLDER)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    from email_routing import email_tier  # type: ignore
+    workbook = any(kind in ("xlsx", "xls") for kind, _, _ in SCENARIOS[report["scenario"]])
+    return email_tier(report["email_bytes"], workbook)
+
+
+def modelled_duration_ms(report, memory_mb):
+    cpu_ms = min(report["cpu_p50_ms"], report["p50_ms"])
+    return report["p50_ms"] - cpu_ms + cpu_ms * max(1.0, FULL_VCPU_MEMORY_MB / memory_mb)
+
+
+def invocation_cost(duration_ms, memory_mb):
+    return memory_mb / 1024 * duration_ms / 1000 * GB_SECOND_PRICE + REQUEST_PRICE
+
+
+def recommend(report, headroom, max_slowdown):
+    """(memory, modelled duration, cost) of the recommended memory size of one scenario"""
+    options = [(memory_mb, modelled_duration_ms(report, memory_mb)) for memory_mb in MEMORY_SIZES_MB
+               if memory_mb >= report["peak_rss_mb"] * headroom]
+    if not options:
+        options = [(MEMORY_SIZES_MB[-1], modelled_duration_ms(report, MEMORY_SIZES_MB[-1]))]
+    fastest = min(duration for _, duration in options)
+    memory_mb, duration = min(((memory_mb, duration) for memory_mb, duration in options
+                               if duration <= fastest * max_slowdown),
+                              key=lambda option: invocation_cost(option[1], option[0]))
+    return memory_mb, duration, invocation_cost(duration, memory_mb)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--input", help="JSON reports of benchmarks.run --output, instead of running the scenarios")
+    parser.add_argument("--headroom", type=float, default=1.25, help="memory needed over the measured peak RSS")
+    parser.add_argument("--max-slowdown", type=float, default=1.1,
+                        help="accepted duration over the fastest memory size, to save cost")
+    arguments = parser.parse_args()
+
+    if arguments.input:
+        with open(arguments.input) as input_file:
+            reports = [report for report in json.load(input_file) if report["scenario"] in SCENARIOS]
+    else:
+        reports = [run_isolated(name, arguments.iterations) for name in arguments.scenarios]
+
+    tiers = {}
+    print("scenario                     tier    peak_rss_mb  memory_mb  modelled_p50_ms  cost_per_million_usd")
+    for report in reports:
+        tier = scenario_tier(report)
+        memory_mb, duration, cost = recommend(report, arguments.headroom, arguments.max_slowdown)
+        tiers[tier] = max(tiers.get(tier, 0), memory_mb)
+        print(f"{report['scenario']:<28} {tier:<7} {report['peak_rss_mb']:>11.1f}  {memory_mb:>9}  "
+              f"{duration:>15.1f}  {cost * 10 ** 6:>20.2f}")
+    # a tier is sized for the heaviest of its emails
+    print("\nPROCESSING_TIERS memory for cdk.json:")
+    print(json.dumps({tier: {"MEMORY_MB": memory_mb} for tier, memory_mb in sorted(tiers.items())}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
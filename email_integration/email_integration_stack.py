@@ -13,12 +13,22 @@ from aws_cdk import (
     aws_ecs as ecs,
     aws_lakeformation as lakeformation,
     aws_sns_subscriptions as subscriptions,
+    aws_events as events,
+    aws_events_targets as targets,
     Duration,
     Aws,
     Stack
 )
 from constructs import Construct
 
+# The raw emails are routed by size to one of these processors, overridden by PROCESSING_TIERS in cdk.json
+PROCESSING_TIERS = {
+    "small": {"MAX_EMAIL_SIZE_MB": 5, "MEMORY_MB": 512, "TIMEOUT_MINUTES": 5, "BATCH_SIZE": 10, "MAX_CONCURRENCY": 5},
+    "medium": {"MAX_EMAIL_SIZE_MB": 50, "MEMORY_MB": 2048, "TIMEOUT_MINUTES": 10, "BATCH_SIZE": 2,
+               "MAX_CONCURRENCY": 3},
+    "large": {"MEMORY_MB": 8192, "TIMEOUT_MINUTES": 15, "BATCH_SIZE": 1, "MAX_CONCURRENCY": 2},
+}
+
 
 class EmailIntegrationStack(Stack):
 
@@ -33,6 +43,14 @@ class EmailIntegrationStack(Stack):
         SES_RECIPIENT = ingest_configuration.get('SES_RECIPIENT')
         CONFIG_PARSER_KEY = ingest_configuration.get('CONFIG_PARSER_KEY')
         OPS_TEAM_EMAIL = ingest_configuration.get('OPS_TEAM_EMAIL')
+        COMPACTION_SCHEDULE_HOURS = ingest_configuration.get('COMPACTION_SCHEDULE_HOURS', 24)
+        COMPACTION_TARGET_FILE_SIZE_MB = ingest_configuration.get('COMPACTION_TARGET_FILE_SIZE_MB', 128)
+        RAW_QUEUE_BATCH_SIZE = ingest_configuration.get('RAW_QUEUE_BATCH_SIZE', 10)
+        RAW_QUEUE_BATCHING_WINDOW_SECONDS = ingest_configuration.get('RAW_QUEUE_BATCHING_WINDOW_SECONDS', 5)
+        RAW_QUEUE_MAX_CONCURRENCY = ingest_configuration.get('RAW_QUEUE_MAX_CONCURRENCY', 5)
+        RAW_QUEUE_MAX_RECEIVE_COUNT = ingest_configuration.get('RAW_QUEUE_MAX_RECEIVE_COUNT', 3)
+        processing_tiers = {tier: {**settings, **ingest_configuration.get('PROCESSING_TIERS', {}).get(tier, {})}
+                            for tier, settings in PROCESSING_TIERS.items()}
 
         email_integration_bucket = s3.Bucket(self, "s3-email-integration-stream",
                                              bucket_name=f"email-integration-{DATALAKE_ACCOUNT}",
@@ -58,34 +76,78 @@ class EmailIntegrationStack(Stack):
             function_name=f"email_filtering_{Aws.ACCOUNT_ID}",
             description="Email filter",
             code=lambda_.DockerImageCode.from_image_asset("./src/lambdas",
+                                                          file="Dockerfile.filtering",
                                                           cmd=["email_filtering.lambda_handler"]),
             timeout=Duration.seconds(30),
             memory_size=128,
             environment={
                 "BUCKET_NAME": email_integration_bucket.bucket_name,
-                "CONFIG_PARSER_KEY": CONFIG_PARSER_KEY
+                "CONFIG_PARSER_KEY": CONFIG_PARSER_KEY,
+                "CONFIG_CACHE_TTL_SECONDS": "60"
             }
         )
 
-        email_processing_function = lambda_.DockerImageFunction(
+        email_routing_function = lambda_.DockerImageFunction(
             self,
-            "email_processing",
-            function_name=f"email_processing_{Aws.ACCOUNT_ID}",
+            "email_routing",
+            function_name=f"email_routing_{Aws.ACCOUNT_ID}",
+            description="Email router to the processor sized for the email",
             code=lambda_.DockerImageCode.from_image_asset("./src/lambdas",
-                                                          cmd=["email_processing.lambda_handler"]),
-            description="Email processor",
-            timeout=Duration.minutes(5),
-            memory_size=512,
-            role=role_glue_lambda,
+                                                          file="Dockerfile.filtering",
+                                                          cmd=["email_routing.lambda_handler"]),
+            timeout=Duration.minutes(1),
+            memory_size=128,
             environment={
-                "POSSIBLE_EXTENSION_FILE": "csv, xls, xlsx",
-                "GLUE_DATABASE_NAME": GLUE_DATABASE_NAME,
-                "S3_PREFIX_RAW": S3_PREFIX_RAW,
+                "SMALL_MAX_EMAIL_BYTES": str(processing_tiers["small"]["MAX_EMAIL_SIZE_MB"] * 1024 * 1024),
+                "MEDIUM_MAX_EMAIL_BYTES": str(processing_tiers["medium"]["MAX_EMAIL_SIZE_MB"] * 1024 * 1024),
+            }
+        )
+
+        processing_functions = {}
+        for tier, settings in processing_tiers.items():
+            # the small processor keeps the id and name of the single processor it replaces
+            suffix = "" if tier == "small" else f"_{tier}"
+            processing_functions[tier] = lambda_.DockerImageFunction(
+                self,
+                f"email_processing{suffix}",
+                function_name=f"email_processing{suffix}_{Aws.ACCOUNT_ID}",
+                code=lambda_.DockerImageCode.from_image_asset("./src/lambdas",
+                                                              cmd=["email_processing.lambda_handler"]),
+                description=f"Email processor for {tier} emails",
+                timeout=Duration.minutes(settings["TIMEOUT_MINUTES"]),
+                memory_size=settings["MEMORY_MB"],
+                role=role_glue_lambda,
+                environment={
+                    "POSSIBLE_EXTENSION_FILE": "csv, xls, xlsx",
+                    "GLUE_DATABASE_NAME": GLUE_DATABASE_NAME,
+                    "S3_PREFIX_RAW": S3_PREFIX_RAW,
+                    "S3_PREFIX_CURATED": S3_PREFIX_CURATED,
+                    "S3_PREFIX_QUARANTINE": S3_PREFIX_QUARANTINE,
+                    "MAX_CONCURRENT_EMAILS": "4",
+                    "MAX_CONCURRENT_ATTACHMENTS": "4",
+                }
+            )
+
+        curated_compaction_function = lambda_.DockerImageFunction(
+            self,
+            "curated_compaction",
+            function_name=f"curated_compaction_{Aws.ACCOUNT_ID}",
+            code=lambda_.DockerImageCode.from_image_asset("./src/lambdas",
+                                                          cmd=["curated_compaction.lambda_handler"]),
+            description="Merge small curated parquet files",
+            timeout=Duration.minutes(15),
+            memory_size=2048,
+            environment={
+                "BUCKET_NAME": email_integration_bucket.bucket_name,
                 "S3_PREFIX_CURATED": S3_PREFIX_CURATED,
-                "S3_PREFIX_QUARANTINE": S3_PREFIX_QUARANTINE,
+                "COMPACTION_TARGET_FILE_SIZE_MB": str(COMPACTION_TARGET_FILE_SIZE_MB),
             }
         )
 
+        events.Rule(self, "CuratedCompactionSchedule",
+                    schedule=events.Schedule.rate(Duration.hours(COMPACTION_SCHEDULE_HOURS)),
+                    targets=[targets.LambdaFunction(curated_compaction_function)])
+
         s3deploy.BucketDeployment(self, "DeployConfigFile",
                                   sources=[s3deploy.Source.asset("./config")],
                                   destination_bucket=email_integration_bucket,
@@ -93,7 +155,10 @@ class EmailIntegrationStack(Stack):
                                   )
 
         email_integration_bucket.grant_read_write(identity=email_filtering_function)
-        email_integration_bucket.grant_read_write(identity=email_processing_function)
+        email_integration_bucket.grant_read(identity=email_routing_function)
+        for processing_function in processing_functions.values():
+            email_integration_bucket.grant_read_write(identity=processing_function)
+        email_integration_bucket.grant_read_write(identity=curated_compaction_function)
 
         queue_for_quarantine_objects = sqs.Queue(self, "Quarantine_Queue",
                                                  queue_name=f"Quarantine_Queue_{Aws.ACCOUNT_ID}")
@@ -106,20 +171,57 @@ class EmailIntegrationStack(Stack):
             subscription=subs.SqsSubscription(queue_for_quarantine_objects))
         topic_for_quarantine_objects.add_subscription(subscriptions.EmailSubscription(OPS_TEAM_EMAIL))
 
-        email_integration_bucket.add_event_notification(s3.EventType.OBJECT_CREATED_PUT,
+        # quarantined emails are server-side copies, their events are not puts
+        email_integration_bucket.add_event_notification(s3.EventType.OBJECT_CREATED,
                                                         s3n.SnsDestination(topic_for_quarantine_objects),
                                                         s3.NotificationKeyFilter(
                                                             prefix=f"{S3_PREFIX_QUARANTINE}/"
                                                         )
                                                         )
 
+        # raw emails are buffered in SQS so that a burst of emails is processed at a bounded concurrency,
+        # and only the failed messages of a batch are retried before going to the dead letter queue.
+        # The router forwards each message to the queue of the processor sized for its email.
+        dead_letter_queue_for_raw_emails = sqs.Queue(self, "Raw_Email_Dead_Letter_Queue",
+                                                     queue_name=f"Raw_Email_Dead_Letter_Queue_{Aws.ACCOUNT_ID}",
+                                                     retention_period=Duration.days(14))
+
+        def buffered_invocations(queue_id, target, batch_size, max_concurrency):
+            queue = sqs.Queue(self, queue_id,
+                              queue_name=f"{queue_id}_{Aws.ACCOUNT_ID}",
+                              # 6 times the function timeout, as recommended for Lambda event sources
+                              visibility_timeout=Duration.seconds(6 * target.timeout.to_seconds()),
+                              dead_letter_queue=sqs.DeadLetterQueue(
+                                  max_receive_count=RAW_QUEUE_MAX_RECEIVE_COUNT,
+                                  queue=dead_letter_queue_for_raw_emails))
+            queue.grant_consume_messages(target)
+            event_source = lambda_.EventSourceMapping(
+                self, f"{queue_id}_Event_Source",
+                target=target,
+                event_source_arn=queue.queue_arn,
+                batch_size=batch_size,
+                max_batching_window=Duration.seconds(RAW_QUEUE_BATCHING_WINDOW_SECONDS),
+                report_batch_item_failures=True)
+            # not exposed by this version of the CDK constructs
+            event_source.node.default_child.add_property_override(
+                "ScalingConfig", {"MaximumConcurrency": max_concurrency})
+            return queue
+
+        queue_for_raw_emails = buffered_invocations("Raw_Email_Queue", email_routing_function,
+                                                    RAW_QUEUE_BATCH_SIZE, RAW_QUEUE_MAX_CONCURRENCY)
         email_integration_bucket.add_event_notification(s3.EventType.OBJECT_CREATED_PUT,
-                                                        s3n.LambdaDestination(email_processing_function),
+                                                        s3n.SqsDestination(queue_for_raw_emails),
                                                         s3.NotificationKeyFilter(
                                                             prefix=f"{S3_PREFIX_RAW}/"
                                                         )
                                                         )
 
+        for tier, settings in processing_tiers.items():
+            queue_for_tier = buffered_invocations(f"Raw_Email_{tier.capitalize()}_Queue", processing_functions[tier],
+                                                  settings["BATCH_SIZE"], settings["MAX_CONCURRENCY"])
+            queue_for_tier.grant_send_messages(email_routing_function)
+            email_routing_function.add_environment(f"PROCESSING_QUEUE_{tier.upper()}_URL", queue_for_tier.queue_url)
+
         email_integration_db = glue.CfnDatabase(self, "emailIntegrationSystemGlueDB",
                                                 catalog_id=Aws.ACCOUNT_ID,
                                                 database_input=glue.CfnDatabase.DatabaseInputProperty(
@@ -158,6 +260,8 @@ class EmailIntegrationStack(Stack):
         ses.ReceiptRuleSet(self, "RuleSetSinkToS3",
                            rules=[
                                ses.ReceiptRuleOptions(recipients=[SES_RECIPIENT],
+                                                      # spam and virus verdicts for the filtering lambda
+                                                      scan_enabled=True,
                                                       actions=[actions.Lambda(
                                                           function=email_filtering_function,
                                                           invocation_type=actions.LambdaInvocationType.REQUEST_RESPONSE
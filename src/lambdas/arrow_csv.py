@@ -0,0 +1,100 @@
+import io
+
+# pandas dtypes of the cached schemas => Arrow types, so that both CSV engines agree on the types of a table
+PANDAS_TO_ARROW_TYPES = {'Int64': 'int64', 'float64': 'float64', 'boolean': 'bool', 'string': 'string'}
+ARROW_TO_ATHENA_TYPES = {
+    'int8': 'tinyint', 'int16': 'smallint', 'int32': 'int', 'int64': 'bigint',
+    'uint8': 'smallint', 'uint16': 'int', 'uint32': 'bigint', 'uint64': 'bigint',
+    'float': 'float', 'halffloat': 'float', 'double': 'double', 'bool': 'boolean',
+    'string': 'string', 'large_string': 'string',
+}
+ATHENA_TO_ARROW_TYPES = {'tinyint': 'int8', 'smallint': 'int16', 'int': 'int32', 'bigint': 'int64', 'float': 'float',
+                         'double': 'double', 'boolean': 'bool', 'string': 'string'}
+
+
+def column_types(schema):
+    """Arrow column types of a cached pandas schema, for the columns whose type has an Arrow equivalent"""
+    import pyarrow as pa  # type: ignore
+    return {column: pa.type_for_alias(PANDAS_TO_ARROW_TYPES[dtype])
+            for column, dtype in (schema or {}).items() if dtype in PANDAS_TO_ARROW_TYPES}
+
+
+def iter_csv_tables(content, encoding, chunk_rows, schema=None, block_size=1024 * 1024):
+    """
+    Yield a CSV as Arrow tables of about `chunk_rows` rows, 0 reads it in one table.
+    Blocks are parsed and converted by the multithreaded Arrow CSV reader, without any pandas DataFrame.
+    The types of the first block are enforced on the next ones, unless `schema` gives them.
+    """
+    import pyarrow as pa  # type: ignore
+    from pyarrow import csv  # type: ignore
+    read_options = csv.ReadOptions(encoding=encoding, use_threads=True, block_size=block_size)
+    convert_options = csv.ConvertOptions(column_types=column_types(schema), strings_can_be_null=True)
+    if chunk_rows <= 0:
+        yield comparable_types(csv.read_csv(content, read_options=read_options, convert_options=convert_options))
+        return
+    batches, rows = [], 0
+    for batch in csv.open_csv(content, read_options=read_options, convert_options=convert_options):
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= chunk_rows:
+            yield comparable_types(pa.Table.from_batches(batches))
+            batches, rows = [], 0
+    if batches:
+        yield comparable_types(pa.Table.from_batches(batches))
+
+
+def comparable_types(table):
+    """
+    Types the pandas engine would give: empty columns are strings instead of Arrow null columns, so that switching
+    engine does not change the Glue table. Dates and times can not be cast back to their text, the columns Arrow
+    infers as temporal must be read again as strings.
+    """
+    import pyarrow as pa  # type: ignore
+    for index, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(index, field.name, table.column(index).cast(pa.string()))
+    return table
+
+
+def normalize_table(table, normalization):
+    """Arrow counterpart of `TableNormalization.apply` for the tables without declared columns"""
+    import awswrangler as wr  # type: ignore
+    import pyarrow as pa  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+    table = table.rename_columns([wr.catalog.sanitize_column_name(column) for column in table.column_names])
+    for index, field in enumerate(table.schema):
+        column = table.column(index)
+        if normalization.downcast_floats and pa.types.is_float64(field.type):
+            table = table.set_column(index, field.name, column.cast(pa.float32()))
+        elif normalization.categorical_max_ratio > 0 and pa.types.is_string(field.type) and len(column) \
+                and pc.count_distinct(column).as_py() <= normalization.categorical_max_ratio * len(column):
+            table = table.set_column(index, field.name, column.dictionary_encode())
+    return table
+
+
+def athena_types(schema):
+    import pyarrow as pa  # type: ignore
+    types = {}
+    for field in schema:
+        field_type = field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+        types[field.name] = ARROW_TO_ATHENA_TYPES.get(str(field_type), 'string')
+    return types
+
+
+def cast_columns(table, columns_types):
+    """Cast the columns of a table to the Glue types of `columns_types`, as awswrangler does with `dtype`"""
+    import pyarrow as pa  # type: ignore
+    for column, column_type in columns_types.items():
+        index = table.schema.get_field_index(column)
+        if index >= 0:
+            table = table.set_column(index, column,
+                                     table.column(index).cast(pa.type_for_alias(ATHENA_TO_ARROW_TYPES[column_type])))
+    return table
+
+
+def put_parquet(s3_client, table, bucket_name, key, extra_args):
+    """Write a table as one snappy parquet file"""
+    import pyarrow.parquet as pq  # type: ignore
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression='snappy')
+    s3_client.put_object(Bucket=bucket_name, Key=key, Body=buffer.getvalue(), **extra_args)
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import time
+
+from botocore.exceptions import ClientError  # type: ignore
+
+logger = logging.getLogger()
+
+# Glue types a column of an append can be cast to without losing its values, by type of the appended column
+LOSSLESS_CASTS = {
+    'tinyint': {'smallint', 'int', 'bigint', 'double', 'string'},
+    'smallint': {'int', 'bigint', 'double', 'string'},
+    'int': {'bigint', 'double', 'string'},
+    'bigint': {'double', 'string'},
+    'float': {'double', 'string'},
+    'double': {'string'},
+    'boolean': {'string'},
+    'date': {'string'},
+    'timestamp': {'string'},
+}
+
+
+def schema_fingerprint(columns_types, partitions_types=None, parameters=None, description=None):
+    """Hash of everything a parquet append would write into the Glue table definition"""
+    definition = {
+        'columns': columns_types,
+        'partitions': partitions_types or {},
+        'parameters': parameters or {},
+        'description': description,
+    }
+    return hashlib.sha256(json.dumps(definition, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def partition_keys(glue_table):
+    return [key['Name'] for key in glue_table.get('PartitionKeys', [])]
+
+
+def stored_columns_types(glue_table):
+    return {column['Name']: column['Type'] for column in glue_table['StorageDescriptor']['Columns']}
+
+
+def catalog_casts(glue_table, columns_types):
+    """Columns of an append to cast to the wider type the Glue table holds them with, {column: Glue type}"""
+    if glue_table is None:
+        return {}
+    stored_types = stored_columns_types(glue_table)
+    return {column: stored_types[column] for column, column_type in columns_types.items()
+            if stored_types.get(column, column_type) in LOSSLESS_CASTS.get(column_type, ())}
+
+
+def catalog_conflict(glue_table, columns_types, partitions_types=None):
+    """
+    Why an append of these column and partition types does not fit the Glue table, None when it does.
+    Columns that can be cast to the type of the table without losing values fit it, see `catalog_casts`.
+    `glue_table` is the Table of a GetTable response, None for a table that does not exist yet.
+    """
+    if glue_table is None:
+        return None
+    # an append keeps the partition keys of the table, the files would land in directories it does not describe
+    if partition_keys(glue_table) != list(partitions_types or {}):
+        return f"partition keys of {glue_table['Name']} are {partition_keys(glue_table)}, " \
+               f"not {list(partitions_types or {})}"
+    stored_types = stored_columns_types(glue_table)
+    casts = catalog_casts(glue_table, columns_types)
+    changed = [f'{column} {stored_types[column]} => {column_type}' for column, column_type in columns_types.items()
+               if column in stored_types and stored_types[column] != column_type and column not in casts]
+    if changed:
+        return f"column types of {glue_table['Name']} changed: {', '.join(changed)}"
+    return None
+
+
+def catalog_describes(glue_table, columns_types, partitions_types=None):
+    """True when the Glue table holds every column with the given type, as after an append of these types"""
+    if glue_table is None or partition_keys(glue_table) != list(partitions_types or {}):
+        return False
+    stored_types = stored_columns_types(glue_table)
+    return all(stored_types.get(column) == column_type for column, column_type in columns_types.items())
+
+
+class MemoryFingerprintStore:
+    """Fingerprints kept in the warm Lambda container only"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, database, table):
+        return self.entries.get((database, table))
+
+    def put(self, database, table, entry):
+        self.entries[(database, table)] = entry
+
+
+class S3FingerprintStore:
+    """Fingerprints shared by all the Lambda containers, one small JSON object per table"""
+
+    def __init__(self, s3_client, bucket_name, prefix):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip('/')
+
+    def key(self, database, table):
+        return f"{self.prefix}/{database}/{table}.json"
+
+    def get(self, database, table):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.key(database, table))
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    def put(self, database, table, entry):
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=self.key(database, table),
+                                  Body=json.dumps(entry).encode('utf-8'), ContentType='application/json')
+
+
+class CatalogWriteCache:
+    """
+    Remember the fingerprint of the Glue table definition written by the last catalog update.
+    Callers only remember a fingerprint once the table read back from Glue describes it.
+
+    An append whose fingerprint is unchanged only needs to write data files. Entries expire after
+    `ttl_seconds` so that a table modified or dropped outside of this pipeline is eventually rewritten.
+    Lookups go to the in-memory entries first and then to the optional shared store.
+    """
+
+    def __init__(self, store=None, ttl_seconds=3600):
+        self.memory = MemoryFingerprintStore()
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+
+    def _is_fresh(self, entry, fingerprint):
+        return entry is not None and entry.get('fingerprint') == fingerprint \
+            and time.time() - entry.get('updated_at', 0) < self.ttl_seconds
+
+    def current_entry(self, database, table, fingerprint):
+        """Entry remembered for this definition of the table, None when the catalog has to be updated"""
+        entry = self.memory.get(database, table)
+        if self._is_fresh(entry, fingerprint):
+            return entry
+        if self.store is None:
+            return None
+        try:
+            entry = self.store.get(database, table)
+        except ClientError as error:
+            logger.error(f'catalog cache lookup {database}.{table} {error}')
+            return None
+        if self._is_fresh(entry, fingerprint):
+            self.memory.put(database, table, entry)
+            return entry
+        return None
+
+    def is_current(self, database, table, fingerprint):
+        return self.current_entry(database, table, fingerprint) is not None
+
+    def remember(self, database, table, fingerprint, cast_types=None):
+        """`cast_types` are the Glue types the appends of this definition are cast to, see `catalog_casts`"""
+        entry = {'fingerprint': fingerprint, 'updated_at': time.time(), 'cast_types': cast_types or {}}
+        self.memory.put(database, table, entry)
+        if self.store is not None:
+            try:
+                self.store.put(database, table, entry)
+            except ClientError as error:
+                logger.error(f'catalog cache update {database}.{table} {error}')
@@ -0,0 +1,56 @@
+import json
+import logging
+import time
+
+from botocore.exceptions import ClientError  # type: ignore
+
+logger = logging.getLogger()
+
+NOT_MODIFIED_ERROR_CODES = ('304', 'NotModified')
+
+
+class S3ConfigCache:
+    """
+    Keep a parsed JSON configuration object from S3 across warm Lambda invocations.
+
+    The object is re-validated at most once every `ttl_seconds` with a conditional GET on
+    its ETag, so an unchanged configuration costs no download nor JSON parsing. Values built
+    from the configuration with `derived` are memoized until the ETag changes.
+    """
+
+    def __init__(self, s3_client, bucket_name, key, ttl_seconds=60):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.ttl_seconds = ttl_seconds
+        self.etag = None
+        self._configuration = None
+        self._checked_at = 0.0
+        self._derived = {}
+
+    def get(self):
+        now = time.monotonic()
+        if self._configuration is not None and now - self._checked_at < self.ttl_seconds:
+            return self._configuration
+        request = {'Bucket': self.bucket_name, 'Key': self.key}
+        if self.etag is not None:
+            request['IfNoneMatch'] = self.etag
+        try:
+            response = self.s3_client.get_object(**request)
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') not in NOT_MODIFIED_ERROR_CODES:
+                raise
+            self._checked_at = now
+            return self._configuration
+        self._configuration = json.loads(response['Body'].read())
+        self.etag = response.get('ETag')
+        self._checked_at = now
+        self._derived = {}
+        logger.info(f'configuration s3://{self.bucket_name}/{self.key} loaded, version {self.etag}')
+        return self._configuration
+
+    def derived(self, builder):
+        configuration = self.get()
+        if builder not in self._derived:
+            self._derived[builder] = builder(configuration)
+        return self._derived[builder]
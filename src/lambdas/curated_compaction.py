@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import posixpath
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import awswrangler as wr  # type: ignore
+import boto3  # type: ignore
+
+from s3_tagging import tagging_header
+
+# Small parquet files of a directory are merged into files of about this size
+COMPACTION_TARGET_FILE_SIZE_MB = int(os.environ.get('COMPACTION_TARGET_FILE_SIZE_MB', 128))
+# Files younger than this may still be part of an email being processed
+COMPACTION_MIN_FILE_AGE_MINUTES = int(os.environ.get('COMPACTION_MIN_FILE_AGE_MINUTES', 60))
+# delete_objects accepts at most 1000 keys
+MAX_FILES_PER_BATCH = 1000
+# Written next to the files of a compaction before the merged file, deleted once its sources are deleted.
+# Athena skips the files whose name starts with an underscore.
+MANIFEST_PREFIX = '_compaction-'
+
+s3_client = boto3.client('s3')
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def notify_team(error='error'):
+    logger.critical(f"notify team with error {error}")
+
+
+def list_curated_files(bucket_name, prefix, target_size, min_age):
+    """
+    Group the parquet files under `prefix` smaller than `target_size` by directory,
+    and list the manifests of the compactions that have not deleted their sources yet
+    """
+    directories = {}
+    manifests = []
+    created_before = datetime.now(timezone.utc) - min_age
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{prefix}/"):
+        for s3_object in page.get('Contents', []):
+            if posixpath.basename(s3_object['Key']).startswith(MANIFEST_PREFIX):
+                manifests.append(s3_object)
+            if not s3_object['Key'].endswith('.parquet') or s3_object['Size'] >= target_size \
+                    or s3_object['LastModified'] > created_before:
+                continue
+            directories.setdefault(posixpath.dirname(s3_object['Key']), []).append(s3_object)
+    return directories, manifests
+
+
+def delete_sources(bucket_name, manifest_key, manifest):
+    """Delete the sources of a merged file, then its manifest. Returns False when some sources are left."""
+    response = s3_client.delete_objects(Bucket=bucket_name,
+                                        Delete={'Objects': [{'Key': key} for key in manifest['source_keys']],
+                                                'Quiet': True})
+    if response.get('Errors'):
+        # the manifest is kept, the next run deletes them
+        logger.critical(f"compaction into {manifest['merged_key']} could not delete {response['Errors']}")
+        notify_team("compaction_delete_failed")
+        return False
+    s3_client.delete_object(Bucket=bucket_name, Key=manifest_key)
+    return True
+
+
+def object_exists(bucket_name, key):
+    try:
+        s3_client.head_object(Bucket=bucket_name, Key=key)
+    except s3_client.exceptions.ClientError as error:
+        if error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+    return True
+
+
+def resume_compactions(bucket_name, manifests, min_age):
+    """
+    Finish the compactions interrupted between their merged file and the deletion of their sources.
+    Manifests younger than `min_age` may belong to a running compaction, their sources are only left alone.
+    Returns the keys of the sources that must not be compacted again.
+    """
+    created_before = datetime.now(timezone.utc) - min_age
+    excluded_keys = set()
+    for s3_object in manifests:
+        manifest = json.loads(s3_client.get_object(Bucket=bucket_name, Key=s3_object['Key'])['Body'].read())
+        excluded_keys.update(manifest['source_keys'])
+        if s3_object['LastModified'] > created_before:
+            continue
+        if object_exists(bucket_name, manifest['merged_key']):
+            if delete_sources(bucket_name, s3_object['Key'], manifest):
+                logger.info(f"sources of {manifest['merged_key']} deleted by a later run")
+        else:
+            # the merged file was never written, the sources are still the only copy of their rows
+            s3_client.delete_object(Bucket=bucket_name, Key=s3_object['Key'])
+            excluded_keys.difference_update(manifest['source_keys'])
+    return excluded_keys
+
+
+def plan_batches(files, target_size):
+    """First-fit of the files, largest first, in batches of at most `target_size` bytes"""
+    batches = []
+    for s3_object in sorted(files, key=lambda _object: _object['Size'], reverse=True):
+        for batch in batches:
+            if batch['size'] + s3_object['Size'] <= target_size and len(batch['keys']) < MAX_FILES_PER_BATCH:
+                batch['keys'].append(s3_object['Key'])
+                batch['size'] += s3_object['Size']
+                break
+        else:
+            batches.append({'keys': [s3_object['Key']], 'size': s3_object['Size']})
+    return [batch['keys'] for batch in batches if len(batch['keys']) > 1]
+
+
+def compact_batch(bucket_name, directory, keys):
+    """
+    Merge the files of a batch into a single new file, then delete them.
+    The merged file is written with one PUT before the sources are removed with one DeleteObjects call,
+    so readers never miss rows; they can see them twice only between these two requests. A manifest listing
+    the sources is written first, a run interrupted before it deletes them is finished by the next one.
+    """
+    compaction_id = uuid.uuid4().hex
+    merged_key = f"{directory}/compacted-{compaction_id}.snappy.parquet"
+    manifest_key = f"{directory}/{MANIFEST_PREFIX}{compaction_id}.json"
+    manifest = {'merged_key': merged_key, 'source_keys': keys}
+    s3_client.put_object(Bucket=bucket_name, Key=manifest_key, Body=json.dumps(manifest).encode('utf-8'),
+                         ContentType='application/json', Tagging=tagging_header())
+    try:
+        merged_data_frame = wr.s3.read_parquet(path=[f"s3://{bucket_name}/{key}" for key in keys])
+        wr.s3.to_parquet(df=merged_data_frame,
+                         path=f"s3://{bucket_name}/{merged_key}",
+                         s3_additional_kwargs={'Tagging': tagging_header()})
+    except Exception:
+        if not object_exists(bucket_name, merged_key):
+            s3_client.delete_object(Bucket=bucket_name, Key=manifest_key)
+        raise
+    delete_sources(bucket_name, manifest_key, manifest)
+    logger.info(f'{len(keys)} files of {directory} compacted into {merged_key}')
+    return merged_key
+
+
+def lambda_handler(event, context):
+    bucket_name = os.environ.get('BUCKET_NAME')
+    curated_prefix = os.environ.get('S3_PREFIX_CURATED')
+    target_size = COMPACTION_TARGET_FILE_SIZE_MB * 1024 * 1024
+    min_age = timedelta(minutes=COMPACTION_MIN_FILE_AGE_MINUTES)
+    directories, manifests = list_curated_files(bucket_name, curated_prefix, target_size, min_age)
+    excluded_keys = resume_compactions(bucket_name, manifests, min_age)
+    compacted_files = 0
+    for directory, files in directories.items():
+        files = [s3_object for s3_object in files if s3_object['Key'] not in excluded_keys]
+        for keys in plan_batches(files, target_size):
+            try:
+                compact_batch(bucket_name, directory, keys)
+                compacted_files += len(keys)
+            except Exception as error:
+                # files with incompatible schemas are left as they are
+                logger.critical(f"Failed compaction of {directory} {error}")
+                notify_team("compaction_failed")
+    logger.info(f'{compacted_files} files compacted in {len(directories)} directories')
+    return {'compacted_files': compacted_files}
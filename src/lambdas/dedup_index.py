@@ -0,0 +1,74 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+from botocore.exceptions import ClientError  # type: ignore
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def content_digest(content):
+    """SHA-256 of a seekable binary buffer, read by chunks and rewound afterwards"""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in iter(lambda: content.read(HASH_CHUNK_BYTES), b''):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def dedup_key(digest, sender, table):
+    return hashlib.sha256(f"{digest}/{sender.lower()}/{table}".encode('utf-8')).hexdigest()
+
+
+class MemoryDedupIndex:
+    """Keys processed by the warm Lambda container, for tests and local runs"""
+
+    def __init__(self):
+        self.keys = set()
+
+    def seen(self, key):
+        return key in self.keys
+
+    def mark(self, key):
+        self.keys.add(key)
+
+
+class SqliteDedupIndex:
+    """Keys persisted in a local SQLite file, for tests and local runs"""
+
+    def __init__(self, path=':memory:'):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS dedup_index (key TEXT PRIMARY KEY, created_at REAL)")
+
+    def seen(self, key):
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM dedup_index WHERE key = ?", (key,)).fetchone() is not None
+
+    def mark(self, key):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO dedup_index VALUES (?, ?)", (key, time.time()))
+
+
+class S3DedupIndex:
+    """Keys shared by all the Lambda containers, one empty marker object per key"""
+
+    def __init__(self, s3_client, bucket_name, prefix):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip('/')
+
+    def seen(self, key):
+        try:
+            self.s3_client.head_object(Bucket=self.bucket_name, Key=f"{self.prefix}/{key}")
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def mark(self, key):
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=f"{self.prefix}/{key}", Body=b'')
@@ -2,36 +2,55 @@ import logging
 import os
 
 import boto3
-import json
 
-s3_resource = boto3.resource('s3')
+from config_cache import S3ConfigCache
+from email_rules import FilteringRules
+from sender_allow_list import SenderAllowList
+
+s3_client = boto3.client('s3')
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Kept at module level so that warm invocations reuse the parsed configuration and allow-list
+CONFIG_CACHE_TTL_SECONDS = int(os.environ.get('CONFIG_CACHE_TTL_SECONDS', '60'))
+config_cache = None
+
 
 def notify_team(error='error'):
     logger.critical(f"notify team with error {error}")
 
+
+def get_config_cache():
+    global config_cache
+    if config_cache is None:
+        config_cache = S3ConfigCache(s3_client,
+                                     bucket_name=os.environ.get('BUCKET_NAME'),
+                                     key=os.environ.get('CONFIG_PARSER_KEY'),
+                                     ttl_seconds=CONFIG_CACHE_TTL_SECONDS)
+    return config_cache
+
+
 def lambda_handler(event, context):
-    logger.info(f'event {event}')
-    bucket_name = os.environ.get('BUCKET_NAME')
-    config_parser_key = os.environ.get('CONFIG_PARSER_KEY')
-    obj = s3_resource.Object(bucket_name, config_parser_key)
-    email_configuration = json.loads(obj.get()['Body'].read())
-    logger.info(f'email configuration : {email_configuration}')
-    accepted_senders = email_configuration.get("ACCEPTED_SENDERS", "None").split(',')
+    logger.info(f"event with {len(event.get('Records', []))} records")
+    accepted_senders = get_config_cache().derived(SenderAllowList.from_config)
+    filtering_rules = get_config_cache().derived(FilteringRules.from_config)
     try:
         for ses_records in event['Records']:
             ses_event = ses_records['ses']
             email_source = ses_event['mail']['source']
             logger.info(f'Email received from {email_source}')
-            if any(_accepted_source.lower() in email_source.lower() for _accepted_source in accepted_senders):
-                logger.info(f'{email_source} accepted into the system')
-            else:
+            if not accepted_senders.is_accepted(email_source):
                 logger.info(f'{email_source} rejected')
                 notify_team("email_source_rejected")
                 return {'disposition': 'STOP_RULE_SET'}
+            # stopping the rule set here also skips the S3 action, the email never reaches the processing
+            rejection_reason = filtering_rules.rejection_reason(ses_event)
+            if rejection_reason:
+                logger.info(f'{email_source} rejected: {rejection_reason}')
+                notify_team(f"email_rejected {rejection_reason}")
+                return {'disposition': 'STOP_RULE_SET'}
+            logger.info(f'{email_source} accepted into the system')
     except Exception as error:
         logger.critical(f"Failed Lambda run {error}")
         notify_team("fail_lambda_run")
@@ -1,21 +1,95 @@
-import pandas as pd  # type: ignore
-import mailparser  # type: ignore
 import boto3  # type: ignore
 import io  # type: ignore
+import json
 from slugify import slugify  # type: ignore
-import time
 import sys
 import traceback
 import base64
+import hashlib
+import itertools
 import logging
 import os
-import awswrangler as wr  # type: ignore
-import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import partial
+
+from botocore.exceptions import ClientError  # type: ignore
+
+from arrow_csv import athena_types, cast_columns, iter_csv_tables, normalize_table, put_parquet
+from catalog_cache import (CatalogWriteCache, S3FingerprintStore, catalog_casts, catalog_conflict, catalog_describes,
+                           schema_fingerprint)
+from config_cache import S3ConfigCache
+from dedup_index import MemoryDedupIndex, S3DedupIndex, SqliteDedupIndex, content_digest, dedup_key
+from excel_workbook import iter_sheet_chunks, open_workbook, workbook_size_error
+from metrics import profiled, stage
+from mime_stream import StreamedEmail
+from normalization import Normalization
+from s3_tagging import tag_objects, tagging_header
+
+# pandas, awswrangler, openpyxl and mailparser take most of the cold start: they are imported
+# by the functions that need them, once an email actually has an attachment to parse.
 
 TEMPORARY_LAMBDA_FOLDER = "tmp"
+# Parse the raw email incrementally and decode each attachment once into a spooled buffer
+EMAIL_STREAMING_MODE = os.environ.get('EMAIL_STREAMING_MODE', 'true').lower() == 'true'
+S3_STREAM_CHUNK_BYTES = int(os.environ.get('S3_STREAM_CHUNK_BYTES', 1024 * 1024))
+ATTACHMENT_SPOOL_MAX_BYTES = int(os.environ.get('ATTACHMENT_SPOOL_MAX_BYTES', 32 * 1024 * 1024))
+# Number of S3 records, and of attachments within one email, processed at the same time
+MAX_CONCURRENT_EMAILS = int(os.environ.get('MAX_CONCURRENT_EMAILS', 4))
+MAX_CONCURRENT_ATTACHMENTS = int(os.environ.get('MAX_CONCURRENT_ATTACHMENTS', 4))
+# Sheets of one workbook converted at the same time, each sheet goes in its own table
+MAX_CONCURRENT_SHEETS = int(os.environ.get('MAX_CONCURRENT_SHEETS', 4))
+CONFIG_CACHE_TTL_SECONDS = int(os.environ.get('CONFIG_CACHE_TTL_SECONDS', '60'))
+# "write": objects are tagged by the request that writes them, "batch": tagged afterwards with retries
+S3_TAGGING_MODE = os.environ.get('S3_TAGGING_MODE', 'write').lower()
+# Rows read and written to parquet at a time, 0 reads the whole attachment at once
+CSV_CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', 100000))
+# "arrow" parses the CSV attachments into Arrow tables written straight to parquet, without pandas.
+# Excel attachments, and the tables with declared normalization columns, always use pandas.
+CSV_ENGINE = os.environ.get('CSV_ENGINE', 'pandas').lower()
+EXCEL_CHUNK_ROWS = int(os.environ.get('EXCEL_CHUNK_ROWS', 50000))
+# Workbooks beyond these rows (all sheets) or uncompressed bytes go in quarantine instead of timing out, 0 disables
+EXCEL_MAX_ROWS = int(os.environ.get('EXCEL_MAX_ROWS', 2000000))
+EXCEL_MAX_BYTES = int(os.environ.get('EXCEL_MAX_BYTES', 1024 * 1024 * 1024))
+SCHEMA_CACHE_MAX_ENTRIES = int(os.environ.get('SCHEMA_CACHE_MAX_ENTRIES', 1024))
+# Appends with an unchanged table definition skip the Glue catalog update, optionally shared through S3
+CATALOG_CACHE_TTL_SECONDS = int(os.environ.get('CATALOG_CACHE_TTL_SECONDS', 3600))
+CATALOG_CACHE_S3_PREFIX = os.environ.get('CATALOG_CACHE_S3_PREFIX')
+# "manifest": a rejected attachment is a JSON manifest pointing into the quarantined email, which is copied once
+# server side. "copy": the decoded attachment is uploaded, in one request up to QUARANTINE_PUT_MAX_BYTES.
+QUARANTINE_ATTACHMENT_MODE = os.environ.get('QUARANTINE_ATTACHMENT_MODE', 'manifest').lower()
+QUARANTINE_PUT_MAX_BYTES = int(os.environ.get('QUARANTINE_PUT_MAX_BYTES', 8 * 1024 * 1024))
+TABLE_DESCRIPTION = "Table created automatically from the email parser system"
+# Attachments already pushed in curated for the same sender and table are skipped: s3, sqlite, memory or none
+DEDUP_BACKEND = os.environ.get('DEDUP_BACKEND', 's3').lower()
+DEDUP_S3_PREFIX = os.environ.get('DEDUP_S3_PREFIX', 'dedup_index')
+DEDUP_SQLITE_PATH = os.environ.get('DEDUP_SQLITE_PATH', f'/{TEMPORARY_LAMBDA_FOLDER}/dedup_index.sqlite3')
+# Curated datasets are partitioned by received date (and optionally sender) with Athena partition projection,
+# so new partitions are queryable without crawlers nor partition registration
+CURATED_PARTITIONING = os.environ.get('CURATED_PARTITIONING', 'true').lower() == 'true'
+CURATED_PARTITION_BY_SENDER = os.environ.get('CURATED_PARTITION_BY_SENDER', 'false').lower() == 'true'
+CURATED_PROJECTION_START_DATE = os.environ.get('CURATED_PROJECTION_START_DATE', '20200101')
+PARTITION_COLUMN_DATE = 'email_received_date'
+PARTITION_COLUMN_SENDER = 'email_sender'
+# Throttling and server errors fail the SQS message so that the email is retried, instead of being quarantined
+# or dropped. The parquet files are named after the email and the content of the attachment, the retry overwrites
+# those of the failed attempt.
+RETRYABLE_ERROR_CODES = ('SlowDown', 'Throttling', 'ThrottlingException', 'ThrottledException',
+                         'TooManyRequestsException', 'RequestLimitExceeded', 'ProvisionedThroughputExceededException',
+                         'RequestTimeout', 'InternalError', 'InternalServiceException', 'ServiceUnavailable',
+                         'ConcurrentModificationException')
 
+# boto3 clients are thread safe, resources and sessions are not: awswrangler gets one session per thread
 s3_client = boto3.client('s3')
-s3_resource = boto3.resource('s3')
+glue_client = boto3.client('glue')
+thread_local = threading.local()
+config_caches = {}
+catalog_caches = {}
+dedup_indexes = {}
+# (sender, table) => {column: dtype} settled for a previous email, reused while the next ones fit it
+inferred_schemas = {}
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -24,22 +98,252 @@ def notify_team(error='error'):
     logger.critical(f"notify team with error {error}")
 
 
+def is_retryable(error):
+    if not isinstance(error, ClientError):
+        return False
+    return error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES \
+        or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+
+
+def thread_boto3_session():
+    if not hasattr(thread_local, 'boto3_session'):
+        thread_local.boto3_session = boto3.Session()
+    return thread_local.boto3_session
+
+
+def get_config_cache(bucket_name, key):
+    if (bucket_name, key) not in config_caches:
+        config_caches[(bucket_name, key)] = S3ConfigCache(s3_client, bucket_name, key,
+                                                          ttl_seconds=CONFIG_CACHE_TTL_SECONDS)
+    return config_caches[(bucket_name, key)]
+
+
+def write_tagging_args():
+    """Extra arguments of a write request tagging the object, empty when objects are tagged in a batch afterwards"""
+    if S3_TAGGING_MODE == 'write':
+        return {'Tagging': tagging_header()}
+    return {}
+
+
+def tag_written_objects(bucket_name, keys):
+    if S3_TAGGING_MODE == 'batch':
+        with stage('tagging', objects=len(keys)):
+            failed_keys = tag_objects(s3_client, bucket_name, keys)
+        if failed_keys:
+            notify_team(f"tagging_failed {failed_keys}")
+
+
+def get_catalog_cache(bucket_name):
+    if bucket_name not in catalog_caches:
+        store = S3FingerprintStore(s3_client, bucket_name, CATALOG_CACHE_S3_PREFIX) if CATALOG_CACHE_S3_PREFIX else None
+        catalog_caches[bucket_name] = CatalogWriteCache(store, ttl_seconds=CATALOG_CACHE_TTL_SECONDS)
+    return catalog_caches[bucket_name]
+
+
+def get_glue_table(database, table):
+    """Definition of a curated table in the Glue catalog, None when it does not exist yet"""
+    import awswrangler as wr  # type: ignore
+    try:
+        return glue_client.get_table(DatabaseName=database, Name=wr.catalog.sanitize_table_name(table))['Table']
+    except glue_client.exceptions.EntityNotFoundException:
+        return None
+
+
+def get_dedup_index(bucket_name):
+    if DEDUP_BACKEND == 'none':
+        return None
+    if bucket_name not in dedup_indexes:
+        if DEDUP_BACKEND == 'sqlite':
+            dedup_indexes[bucket_name] = SqliteDedupIndex(DEDUP_SQLITE_PATH)
+        elif DEDUP_BACKEND == 'memory':
+            dedup_indexes[bucket_name] = MemoryDedupIndex()
+        else:
+            dedup_indexes[bucket_name] = S3DedupIndex(s3_client, bucket_name, DEDUP_S3_PREFIX)
+    return dedup_indexes[bucket_name]
+
+
+def curated_partitioning_settings():
+    """Partition columns of the curated datasets and their projection settings"""
+    if not CURATED_PARTITIONING:
+        return [], None
+    import awswrangler as wr  # type: ignore
+    partition_cols = [PARTITION_COLUMN_DATE]
+    projection_settings = wr.typing.AthenaPartitionProjectionSettings(
+        projection_types={PARTITION_COLUMN_DATE: 'date'},
+        projection_ranges={PARTITION_COLUMN_DATE: f'{CURATED_PROJECTION_START_DATE},NOW'},
+        projection_formats={PARTITION_COLUMN_DATE: 'yyyyMMdd'},
+        projection_intervals={PARTITION_COLUMN_DATE: '1'},
+    )
+    if CURATED_PARTITION_BY_SENDER:
+        # injected: Athena queries must filter on the sender with an equality
+        partition_cols.append(PARTITION_COLUMN_SENDER)
+        projection_settings['projection_types'][PARTITION_COLUMN_SENDER] = 'injected'
+    return partition_cols, projection_settings
+
+
+def stable_schema(pandas_data_frame):
+    """
+    Dtypes of a DataFrame widened to types that any later chunk of the same table can be cast to:
+    nullable integers and booleans, 64 bits floats and strings.
+    """
+    schema = {}
+    for column, dtype in pandas_data_frame.dtypes.items():
+        if dtype.kind in 'iu':
+            schema[column] = 'Int64'
+        elif dtype.kind == 'f':
+            schema[column] = 'float64'
+        elif dtype.kind == 'b':
+            schema[column] = 'boolean'
+        elif dtype.kind == 'M':
+            schema[column] = str(dtype)
+        else:
+            schema[column] = 'string'
+    return schema
+
+
+def cache_schema(schema_key, schema):
+    if schema_key not in inferred_schemas and len(inferred_schemas) >= SCHEMA_CACHE_MAX_ENTRIES:
+        inferred_schemas.pop(next(iter(inferred_schemas)), None)
+    inferred_schemas[schema_key] = schema
+
+
+def widen_schema(schema, other_schema):
+    """Schema of a table whose chunks have these schemas: integers widen to floats, other disagreements to strings"""
+    widened = {}
+    for column, dtype in schema.items():
+        other_dtype = other_schema.get(column, dtype)
+        if dtype == other_dtype:
+            widened[column] = dtype
+        elif {dtype, other_dtype} == {'Int64', 'float64'}:
+            widened[column] = 'float64'
+        else:
+            widened[column] = 'string'
+    return widened
+
+
+def fit_schema(pandas_data_frame, schema):
+    """Cast a chunk to `schema`, raise ValueError when its columns or values do not fit"""
+    if list(schema) != [str(column) for column in pandas_data_frame.columns]:
+        raise ValueError(f'columns {list(pandas_data_frame.columns)} are not those of the schema {list(schema)}')
+    return pandas_data_frame.astype(schema)
+
+
+def settled_chunks(read_chunks, schema_key):
+    """
+    Chunks of a table, all cast to the schema of the whole table so that its parquet files never disagree.
+
+    `read_chunks(schema)` returns a new iterator over the chunks, read with the dtypes of `schema`, None infers
+    them. A first pass settles the schema: the one cached for the table if every chunk fits it, otherwise the
+    schemas inferred from each chunk widened together. Nothing is written during that pass, a table read in
+    one chunk is not read again.
+    """
+    schema = inferred_schemas.get(schema_key)
+    while True:
+        table_schema, single_chunk, chunks_read = None, None, 0
+        try:
+            for chunk in read_chunks(schema):
+                chunk = chunk if schema is None else fit_schema(chunk, schema)
+                chunk_schema = stable_schema(chunk)
+                table_schema = chunk_schema if table_schema is None else widen_schema(table_schema, chunk_schema)
+                chunks_read += 1
+                single_chunk = chunk if chunks_read == 1 else None
+        except (ValueError, TypeError) as error:
+            if schema is None:
+                raise
+            logger.info(f'cached schema of {schema_key} does not fit, inferring it again: {error}')
+            inferred_schemas.pop(schema_key, None)
+            schema = None
+            continue
+        break
+    if table_schema is None:
+        return
+    cache_schema(schema_key, table_schema)
+    if single_chunk is not None:
+        yield single_chunk.astype(table_schema)
+        return
+    for chunk in read_chunks(table_schema):
+        yield chunk.astype(table_schema)
+
+
+def settled_arrow_chunks(read_chunks, schema_key):
+    """
+    `settled_chunks` for the Arrow CSV reader, which enforces the types of the first block on the next ones.
+    A first pass checks that the whole file parses with the cached schema, or else with the types of its first
+    block, or else reads every column as a string. Nothing is written during that pass. The columns parsed as
+    dates or times are then read as strings, Arrow would write them in its own format instead of their text.
+    """
+    import pyarrow as pa  # type: ignore
+    cached_schema = schema = inferred_schemas.get(schema_key)
+    fallback_schemas = [None] if schema is not None else []
+    while True:
+        column_names, single_chunk, chunks_read, temporal_columns = None, None, 0, set()
+        try:
+            for chunk in read_chunks(schema):
+                column_names = chunk.column_names
+                temporal_columns.update(field.name for field in chunk.schema if pa.types.is_temporal(field.type))
+                chunks_read += 1
+                single_chunk = chunk if chunks_read == 1 else None
+            break
+        except pa.ArrowInvalid as error:
+            if schema is not None and schema is cached_schema:
+                inferred_schemas.pop(schema_key, None)
+            elif schema is None and column_names is not None:
+                fallback_schemas.append({column: 'string' for column in column_names})
+            if not fallback_schemas:
+                raise
+            logger.info(f"{schema_key} does not parse with the types {schema or 'of its first block'}, "
+                        f"reading it again: {error}")
+            schema = fallback_schemas.pop(0)
+    if temporal_columns:
+        schema = {**(schema or {}), **{column: 'string' for column in temporal_columns}}
+    elif single_chunk is not None:
+        yield single_chunk
+        return
+    if chunks_read:
+        for chunk in read_chunks(schema):
+            yield chunk
+
+
+def run_concurrently(function, items, max_workers):
+    """
+    Call `function` on every item with at most `max_workers` calls in flight.
+    Items are pulled lazily from the iterable, so a generator of attachments is only decoded
+    as fast as the workers consume it. Results are returned in completion order.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for item in items:
+            if len(pending) >= max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+            pending.add(executor.submit(function, item))
+        done, _ = wait(pending)
+        results.extend(future.result() for future in done)
+    return results
+
+
 class EmailParserInstance:
     def __init__(self, paths):
 
         self.bucket_name = paths['s3']['bucket']['name']
         self.email_key = paths['s3']['object']['key']
         self.email_name = slugify(paths['s3']['object']['key'].split('/')[-1])
+        self.email_last_modified = None
         self.email_parsed = self.load_email_parser()
+        self.received_date = self.load_received_date(paths.get('eventTime'))
         self.lambda_download_path = f"/{TEMPORARY_LAMBDA_FOLDER}/{self.email_name}"
         self.STATUS_PUSHED = 0
+        self.status_lock = threading.Lock()
         self.CONFIG_PARSER_KEY = "config/email.json"
         self.POSSIBLE_EXTENSION_FILE = self.S3_PREFIX_QUARANTINE = self.S3_PREFIX_CURATED = None
+        self.normalization = None
         self.load_config_parser()
 
     def load_config_parser(self):
-        obj = s3_resource.Object(self.bucket_name, self.CONFIG_PARSER_KEY)
-        email_configuration = json.loads(obj.get()['Body'].read())
+        config_cache = get_config_cache(self.bucket_name, self.CONFIG_PARSER_KEY)
+        email_configuration = config_cache.get()
+        self.normalization = config_cache.derived(Normalization.from_config)
         self.POSSIBLE_EXTENSION_FILE = email_configuration.get('POSSIBLE_EXTENSION_FILE',
                                                                os.environ.get('POSSIBLE_EXTENSION_FILE', "None").split(
                                                                    ','))
@@ -48,40 +352,73 @@ class EmailParserInstance:
         self.S3_PREFIX_CURATED = email_configuration.get('S3_PREFIX_CURATED', os.environ.get('S3_PREFIX_CURATED'))
 
     def load_email_parser(self):
-        obj = s3_resource.Object(self.bucket_name, self.email_key)
-        email_bytes = obj.get()['Body'].read()
-        mail = mailparser.parse_from_bytes(email_bytes)
-        return mail
+        with stage('s3_fetch', email=self.email_name):
+            response = s3_client.get_object(Bucket=self.bucket_name, Key=self.email_key)
+            self.email_last_modified = response['LastModified']
+            body = response['Body'] if EMAIL_STREAMING_MODE else response['Body'].read()
+        # in streaming mode the body is downloaded while it is parsed
+        with stage('mime_parse', email=self.email_name, size=response['ContentLength']):
+            if EMAIL_STREAMING_MODE:
+                return StreamedEmail.from_stream(body,
+                                                 chunk_size=S3_STREAM_CHUNK_BYTES,
+                                                 spool_max_size=ATTACHMENT_SPOOL_MAX_BYTES)
+            import mailparser  # type: ignore
+            mail = mailparser.parse_from_bytes(body)
+            return mail
+
+    def load_received_date(self, event_time):
+        """
+        Date the email was received, as a naive datetime in UTC: its Date header, else the time SES wrote it in S3.
+        The curated partitions are named after it, a missing date would give one the projection can not address.
+        """
+        try:
+            date = self.email_parsed.date
+        except (TypeError, ValueError):
+            date = None
+        if date is not None:
+            return date
+        logger.info(f'{self.email_name} has no valid Date header, the S3 event time is used')
+        if event_time:
+            written_at = datetime.fromisoformat(event_time.replace('Z', '+00:00'))
+        else:
+            written_at = self.email_last_modified
+        return written_at.astimezone(timezone.utc).replace(tzinfo=None)
 
     def get_attachments_email(self):
-        mail_attachment = self.email_parsed.attachments
-        for attachment in mail_attachment:
+        mail_attachment = iter(self.email_parsed.attachments)
+        while True:
+            # streamed attachments are decoded when they are pulled from the parser
+            with stage('decode', email=self.email_name):
+                attachment = next(mail_attachment, None)
+            if attachment is None:
+                return
             attachment['metadata'] = {}
             attachment['metadata']['received_from'] = slugify(self.email_parsed.from_[0][1])  # get only the email
             attachment['metadata']['sent_to'] = slugify(self.email_parsed.to[0][1])  # get only the email
-            attachment['metadata']['received_date'] = str(self.email_parsed.date)
+            attachment['metadata']['received_date'] = str(self.received_date)
             yield attachment
 
-    def push_email_in_quarantine(self):
+    @property
+    def quarantine_key(self):
+        return f'{self.S3_PREFIX_QUARANTINE}/emails/{self.email_name}'
+
+    def push_email_in_quarantine(self, reason='to_be_defined'):
+        with self.status_lock:  # attachments of the same email can fail concurrently
+            return self._push_email_in_quarantine(reason)
+
+    def _push_email_in_quarantine(self, reason):
         if self.STATUS_PUSHED == 0:
             try:
-                s3_resource.Object(self.bucket_name, f'{self.S3_PREFIX_QUARANTINE}/emails/{self.email_name}').copy_from(
-                    CopySource=self.email_key)
-
-                time.sleep(1)  # wait for copy before tagging
-
-                s3_client.put_object_tagging(
-                    Bucket=self.bucket_name,
-                    Key=f"{self.S3_PREFIX_QUARANTINE}/emails/{self.email_name}",
-                    Tagging={
-                        'TagSet': [{
-                            'Key': "Project",
-                            'Value': "EmailIntegration",
-                        }]
-                    },
-                )
-                error = 'to_be_defined'
-                notify_team(error)
+                tagging_args = write_tagging_args()
+                if tagging_args:
+                    tagging_args['TaggingDirective'] = 'REPLACE'
+                s3_client.copy_object(Bucket=self.bucket_name,
+                                      Key=self.quarantine_key,
+                                      CopySource={'Bucket': self.bucket_name, 'Key': self.email_key},
+                                      **tagging_args)
+                tag_written_objects(self.bucket_name, [self.quarantine_key])
+                # the first reason only, the email is copied once
+                notify_team(reason)
                 self.STATUS_PUSHED = 1
             except s3_client.exceptions.ClientError as e:
                 logging.error(f'put_object_in_quarantine {e}')
@@ -96,94 +433,282 @@ class AttachmentParserInstance:
         self.attachment_filename = slugify(attachment['filename'])
         self.S3_PREFIX_CURATED = self.parent_email.S3_PREFIX_CURATED
         self.S3_PREFIX_QUARANTINE = self.parent_email.S3_PREFIX_QUARANTINE
+        self.arrow_engine = False
+        # set from the content before its tables are read, see `curated_key`
+        self.write_id = None
+        # (table, fingerprint) => plan of its catalog update, checked for every table before any is written
+        self.catalog_plans = {}
+
+    def open_content(self):
+        """
+        Return the decoded attachment as a seekable binary buffer, rewound to its start.
+        The payload is decoded only once and the same buffer is shared by the parser and the uploaders.
+        """
+        content = self.attachment.get('content')
+        if content is None:
+            if self.attachment.get('binary', True):
+                payload = base64.b64decode(self.attachment['payload'])
+            else:
+                payload = self.attachment['payload'].encode(self.attachment.get('charset') or 'utf-8')
+            content = io.BytesIO(payload)
+            self.attachment['payload'] = None
+            self.attachment['size'] = len(payload)
+            self.attachment['content'] = content
+        content.seek(0)
+        return content
+
+    def schema_key(self, table=None):
+        return self.parent_email.email_parsed.from_[0][1], table or self.attachment_filename
 
-    def read_dataframe(self):
+    def sheet_table(self, sheet_index, sheet_name):
+        """The first sheet keeps the table of the attachment, the other sheets get a table of their own"""
+        if sheet_index == 0:
+            return self.attachment_filename
+        return f"{self.attachment_filename}-{slugify(sheet_name)}"
+
+    def reject_table(self, table, reason):
+        """Quarantine an attachment whose types conflict with its Glue table, before any file is written in it"""
+        # the cached schema is the one of the rejected attachment, not the one of the table
+        inferred_schemas.pop(self.schema_key(table), None)
+        logger.critical(f"SchemaMismatch Skip the attachment - {self.attachment['filename']}: {reason}")
+        self.push_attachment_in_quarantine(f'SchemaMismatch {reason}')
+        raise Exception('SchemaMismatch')
+
+    def reject_workbook(self, reason):
+        logger.critical(f"WorkbookTooLarge Skip the attachment - {self.attachment['filename']}: {reason}")
+        self.push_attachment_in_quarantine(f'WorkbookTooLarge {reason}')
+        raise Exception('WorkbookTooLarge')
+
+    @contextmanager
+    def open_tables(self):
+        """
+        (table, read_chunks) of every table of the attachment, `read_chunks(schema)` returns a new iterator over
+        DataFrames of at most CSV_CHUNK_ROWS / EXCEL_CHUNK_ROWS rows, or over Arrow tables with the arrow engine.
+        A workbook has one table per sheet.
+        """
         file_extension = self.attachment['filename'].split('.')[-1].lower()
-        payload = base64.b64decode(self.attachment['payload'])
-        attachment_content = io.BytesIO(payload)
-        if file_extension == 'csv':
-            df = pd.read_csv(attachment_content, low_memory=False)
-            return df
-        elif file_extension in ['xls', 'xlsx']:
-            df = pd.read_excel(io=attachment_content)
-            return df
+        attachment_content = self.open_content()
+        if file_extension == 'csv' and CSV_ENGINE == 'arrow' \
+                and not self.parent_email.normalization.for_table(self.attachment_filename).columns:
+            self.arrow_engine = True
+            yield [(self.attachment_filename, partial(self.iter_arrow_csv_chunks, attachment_content))]
+        elif file_extension == 'csv':
+            yield [(self.attachment_filename, partial(self.iter_csv_chunks, attachment_content))]
+        elif file_extension == 'xlsx':
+            workbook = open_workbook(attachment_content)
+            try:
+                error = workbook_size_error(workbook, attachment_content, EXCEL_MAX_ROWS, EXCEL_MAX_BYTES)
+                if error:
+                    self.reject_workbook(error)
+                yield [(self.sheet_table(index, worksheet.title), partial(self.iter_worksheet_chunks, worksheet))
+                       for index, worksheet in enumerate(workbook.worksheets)]
+            finally:
+                workbook.close()
+        elif file_extension == 'xls':
+            # xlrd has no streaming reader, all the sheets are loaded at once
+            import pandas as pd  # type: ignore
+            if 0 < EXCEL_MAX_BYTES < self.attachment['size']:
+                self.reject_workbook(f"{self.attachment['size']} bytes, limit {EXCEL_MAX_BYTES}")
+            sheets = pd.read_excel(io=attachment_content, sheet_name=None)
+            rows = sum(len(sheet) for sheet in sheets.values())
+            if 0 < EXCEL_MAX_ROWS < rows:
+                self.reject_workbook(f'{rows} rows, limit {EXCEL_MAX_ROWS}')
+            yield [(self.sheet_table(index, sheet_name), lambda schema, sheet=sheet: iter([sheet]))
+                   for index, (sheet_name, sheet) in enumerate(sheets.items())]
         else:
             logger.info('can not read the dataframe - UnknownExtension ')
-            self.push_attachment_in_quarantine()
+            self.push_attachment_in_quarantine('UnknownExtension')
             logger.critical(f"UnknownExtension Skip the attachment - {self.attachment['filename']}")
             raise Exception('UnknownExtension')
 
-    def push_attachment_in_curated(self, pandas_data_frame):
+    def iter_csv_chunks(self, attachment_content, schema=None):
+        import pandas as pd  # type: ignore
+        # charset of the MIME part, text attachments are not always utf-8
+        encoding = self.attachment.get('charset') or 'utf-8'
+        attachment_content.seek(0)
+        if CSV_CHUNK_ROWS <= 0:
+            yield pd.read_csv(attachment_content, encoding=encoding, dtype=schema, low_memory=False)
+            return
+        for chunk in pd.read_csv(attachment_content, encoding=encoding, dtype=schema, chunksize=CSV_CHUNK_ROWS):
+            yield chunk
+
+    def iter_worksheet_chunks(self, worksheet, schema=None):
+        # cells are typed, the schema is applied to the chunks by `settled_chunks`
+        try:
+            for chunk in iter_sheet_chunks(worksheet, EXCEL_CHUNK_ROWS, EXCEL_MAX_ROWS):
+                yield chunk
+        except Exception as error:
+            if str(error) != 'WorkbookTooLarge':
+                raise
+            self.reject_workbook(f'{worksheet.title} has more rows than declared, limit {EXCEL_MAX_ROWS}')
+
+    def iter_arrow_csv_chunks(self, attachment_content, schema=None):
+        attachment_content.seek(0)
+        return iter_csv_tables(attachment_content, self.attachment.get('charset') or 'utf-8', CSV_CHUNK_ROWS, schema)
+
+    def dedup_key(self, digest):
+        return dedup_key(digest, self.parent_email.email_parsed.from_[0][1], self.attachment_filename)
+
+    @property
+    def partition_key_date(self):
         # 2021-01-11 07:29:38 =>  20210111
+        return self.attachment['metadata']['received_date'].split()[0].replace('-', '')
 
-        partition_key_date = self.attachment['metadata']['received_date'].split()[0].replace('-', '')
+    def push_original_attachment(self):
+        partition_key_date = self.partition_key_date
 
         # To be used in case we would like to store the attachment in their original extension and not in Parquet
         object_attachment_name = f"original_{self.S3_PREFIX_CURATED}/{partition_key_date}/" \
                                  f"{self.parent_email.email_parsed.from_[0][1]}/" \
                                  f"{self.attachment_filename}"
 
-        s3_client.upload_file(f"/{TEMPORARY_LAMBDA_FOLDER}/{self.attachment_filename}",
-                              self.parent_email.bucket_name,
-                              object_attachment_name,
-                              ExtraArgs={'Metadata': self.attachment['metadata']}
-                              )
+        s3_client.upload_fileobj(self.open_content(),
+                                 self.parent_email.bucket_name,
+                                 object_attachment_name,
+                                 ExtraArgs={'Metadata': self.attachment['metadata'], **write_tagging_args()}
+                                 )
+        tag_written_objects(self.parent_email.bucket_name, [object_attachment_name])
+
+    def curated_key(self, table, chunk_index):
+        """
+        Key of a parquet file of the attachment in the partition of the email. It is the same for every delivery of
+        the email: a retried email overwrites the files of the failed attempt instead of appending their rows again.
+        """
+        partition_cols, _ = curated_partitioning_settings()
+        partition_values = {PARTITION_COLUMN_DATE: self.partition_key_date,
+                            PARTITION_COLUMN_SENDER: self.attachment['metadata']['received_from']}
+        partition_path = ''.join(f'{column}={partition_values[column]}/' for column in partition_cols)
+        return f"{self.S3_PREFIX_CURATED}/{table}/{partition_path}{self.write_id}-{chunk_index}.snappy.parquet"
+
+    def push_attachment_in_curated(self, pandas_data_frame, table=None, chunk_index=0):
+        import awswrangler as wr  # type: ignore
+        table = table or self.attachment_filename
+        cast_types = self.update_catalog(table, pandas_athena_types(pandas_data_frame))
+        key = self.curated_key(table, chunk_index)
+        # a single file at a known key, a dataset write would give it a random name
+        with stage('parquet_write', table=table, rows=len(pandas_data_frame)):
+            wr.s3.to_parquet(
+                df=pandas_data_frame,
+                path=f"s3://{self.parent_email.bucket_name}/{key}",
+                s3_additional_kwargs=write_tagging_args(),
+                boto3_session=thread_boto3_session(),
+                dtype=cast_types or None,
+            )
+        logger.info(f'Attachment pushed to S3 {key}')
+        tag_written_objects(self.parent_email.bucket_name, [key])
 
+    def update_catalog(self, table, columns_types, plan_only=False):
+        """
+        Update the Glue table for an append of `columns_types`, unless the catalog cache holds it, and return the
+        {column: Glue type} the append is cast to. Done before the data file: a table that can not describe the file
+        must not get it. `plan_only` rejects an append in conflict with the table without updating it.
+        """
+        import awswrangler as wr  # type: ignore
         param = {
             "source": "emailParserSystem",
             "sender": self.parent_email.email_parsed.from_[0][1]
         }
-        res = wr.s3.to_parquet(
-            df=pandas_data_frame,
-            path=f"s3://{self.parent_email.bucket_name}/"
-                 f"{self.S3_PREFIX_CURATED}/"
-                 f"{self.attachment_filename}",
-            dataset=True,
-            database=os.environ.get('GLUE_DATABASE_NAME'),
-            table=self.attachment_filename,
-            mode="append",
-            description="Table created automatically from the email parser system",
-            parameters=param
-            # columns_comments=comments Add meta data on the columns if needed
-        )
-        logger.info(f'Attachment pushed to S3 {res}')
-        time.sleep(1)  # wait for put before tagging
-        for _sub_paths in res['paths']:
-            s3_client.put_object_tagging(
-                Bucket=self.parent_email.bucket_name,
-                Key=_sub_paths.split(f's3://{self.parent_email.bucket_name}/')[1],
-                Tagging={
-                    'TagSet': [{
-                        'Key': "Project",
-                        'Value': "EmailIntegration",
-                    }]
-                },
-            )
+        database = os.environ.get('GLUE_DATABASE_NAME')
+        partition_cols, projection_settings = curated_partitioning_settings()
+        partitions_types = {column: 'string' for column in partition_cols}
+        fingerprint = schema_fingerprint(columns_types, partitions_types,
+                                         {**param, 'projection': projection_settings}, TABLE_DESCRIPTION)
+        if (table, fingerprint) not in self.catalog_plans:
+            self.catalog_plans[(table, fingerprint)] = self.plan_catalog_update(database, table, columns_types,
+                                                                                partitions_types, fingerprint)
+        catalog_updated, cast_types = self.catalog_plans[(table, fingerprint)]
+        if catalog_updated and not plan_only:
+            with stage('catalog_update', table=table):
+                # partitions are resolved by the projection, they are not registered one by one
+                wr.catalog.create_parquet_table(database=database, table=wr.catalog.sanitize_table_name(table),
+                                                path=f"s3://{self.parent_email.bucket_name}/"
+                                                     f"{self.S3_PREFIX_CURATED}/{table}/",
+                                                columns_types={**columns_types, **cast_types},
+                                                partitions_types=partitions_types, compression='snappy',
+                                                description=TABLE_DESCRIPTION, parameters=param, mode='append',
+                                                athena_partition_projection_settings=projection_settings,
+                                                boto3_session=thread_boto3_session())
+            self.remember_catalog(database, table, columns_types, partitions_types, fingerprint, cast_types)
+            self.catalog_plans[(table, fingerprint)] = False, cast_types
+        return cast_types
+
+    def plan_catalog_update(self, database, table, columns_types, partitions_types, fingerprint):
+        """
+        (whether the catalog is updated, {column: Glue type} the append is cast to) for an append of these types.
+        On a catalog cache miss the Glue table is read first: an append that conflicts with it is quarantined
+        before anything is written, the columns it holds with a wider type are cast to that type.
+        """
+        entry = get_catalog_cache(self.parent_email.bucket_name).current_entry(database, table, fingerprint)
+        if entry is not None:
+            return False, entry.get('cast_types', {})
+        with stage('catalog_check', table=table):
+            glue_table = get_glue_table(database, table)
+        # values that do not fit the types of the table would silently become nulls
+        conflict = catalog_conflict(glue_table, columns_types, partitions_types)
+        if conflict:
+            self.reject_table(table, conflict)
+        return True, catalog_casts(glue_table, columns_types)
+
+    def remember_catalog(self, database, table, columns_types, partitions_types, fingerprint, cast_types=None):
+        """
+        Skip the next catalog updates of the same definition, only if the table holds it: an append does not change
+        the type of an existing column, remembering the requested types would let the next files drift from the table
+        """
+        columns_types = {**columns_types, **(cast_types or {})}
+        if catalog_describes(get_glue_table(database, table), columns_types, partitions_types):
+            get_catalog_cache(self.parent_email.bucket_name).remember(database, table, fingerprint, cast_types)
+        else:
+            logger.error(f'{database}.{table} does not hold the types {columns_types} after the catalog update')
+
+    def push_arrow_in_curated(self, arrow_table, table, chunk_index=0):
+        """Counterpart of `push_attachment_in_curated` for Arrow tables, written as parquet by pyarrow"""
+        cast_types = self.update_catalog(table, athena_types(arrow_table.schema))
+        arrow_table = cast_columns(arrow_table, cast_types)
+        key = self.curated_key(table, chunk_index)
+        with stage('parquet_write', table=table, rows=arrow_table.num_rows, engine='arrow'):
+            put_parquet(s3_client, arrow_table, self.parent_email.bucket_name, key, write_tagging_args())
+        logger.info(f'Attachment pushed to S3 {key}')
+        tag_written_objects(self.parent_email.bucket_name, [key])
+
+    def quarantine_manifest(self, reason):
+        """Where to find the attachment in the quarantined email, instead of a copy of its content"""
+        return {
+            'reason': reason,
+            'email': {'bucket': self.parent_email.bucket_name, 'key': self.parent_email.quarantine_key},
+            'source_email': {'bucket': self.parent_email.bucket_name, 'key': self.parent_email.email_key},
+            'filename': self.attachment['filename'],
+            'mail_content_type': self.attachment.get('mail_content_type'),
+            'part_index': self.attachment.get('part_index'),
+            'size': self.attachment.get('size'),
+            'metadata': self.attachment['metadata'],
+        }
 
-    def push_attachment_in_quarantine(self):
+    def push_attachment_in_quarantine(self, reason='to_be_defined'):
+        key = f"{self.S3_PREFIX_QUARANTINE}/attachment/{self.attachment_filename}"
         try:
-            payload = base64.b64decode(self.attachment['payload'])
-
-            with open(f"/{TEMPORARY_LAMBDA_FOLDER}/{self.attachment_filename}", 'wb') as w:
-                w.write(payload)
-            s3_client.upload_file(f"/{TEMPORARY_LAMBDA_FOLDER}/{self.attachment_filename}",
-                                  self.parent_email.bucket_name,
-                                  f"{self.S3_PREFIX_QUARANTINE}/attachment/{self.attachment_filename}",
-                                  ExtraArgs={'Metadata': self.attachment['metadata']})
-            time.sleep(1)  # wait for copy before tagging
-
-            s3_client.put_object_tagging(
-                Bucket=self.parent_email.bucket_name,
-                Key=f"'{self.S3_PREFIX_QUARANTINE}/attachment/{self.attachment_filename}'",
-                Tagging={
-                    'TagSet': [{
-                        'Key': "Project",
-                        'Value': "EmailIntegration",
-                    }]
-                },
-            )
-            error = 'to_be_defined'
-            notify_team(error)
+            if QUARANTINE_ATTACHMENT_MODE == 'manifest':
+                # the raw email is copied server side, the attachment is never uploaded again
+                if not self.parent_email.push_email_in_quarantine(reason):
+                    return False
+                # one manifest per email, same-named attachments of other emails do not overwrite it
+                key = f"{self.S3_PREFIX_QUARANTINE}/attachment/{self.parent_email.email_name}/" \
+                      f"{self.attachment_filename}.json"
+                s3_client.put_object(Bucket=self.parent_email.bucket_name, Key=key,
+                                     Body=json.dumps(self.quarantine_manifest(reason), default=str).encode('utf-8'),
+                                     ContentType='application/json',
+                                     Metadata=self.attachment['metadata'], **write_tagging_args())
+            else:
+                content = self.open_content()
+                if self.attachment['size'] <= QUARANTINE_PUT_MAX_BYTES:
+                    s3_client.put_object(Bucket=self.parent_email.bucket_name, Key=key, Body=content.read(),
+                                         Metadata=self.attachment['metadata'], **write_tagging_args())
+                else:
+                    # multipart upload, straight from the decoded buffer
+                    s3_client.upload_fileobj(content, self.parent_email.bucket_name, key,
+                                             ExtraArgs={'Metadata': self.attachment['metadata'],
+                                                        **write_tagging_args()})
+            tag_written_objects(self.parent_email.bucket_name, [key])
+            notify_team(reason)
         except s3_client.exceptions.ClientError as e:
             logging.error(f'put_object_in_quarantine {e}')
             return False
@@ -196,37 +721,185 @@ class AttachmentParserInstance:
         return False
 
 
-def lambda_handler(event, context):
-    print(f'event {event}')
+def read_table(attachment_instance, table_chunks):
+    """
+    (table, chunks) of one table of an attachment, settled and normalized. The first chunk is read here and its types
+    checked against the Glue table, so that a table in conflict with the catalog rejects the attachment before any
+    of its tables is written. The first chunk of every table is held until the tables are pushed.
+    """
+    table, read_chunks = table_chunks
+    normalization = attachment_instance.parent_email.normalization.for_table(table)
+    settled = settled_chunks(read_chunks, attachment_instance.schema_key(table))
 
-    emails = [EmailParserInstance(paths=paths) for paths in event['Records']]
-    quarantine_objects = []
+    def chunks():
+        while True:
+            with stage('dataframe_read', table=table):
+                df = next(settled, None)
+            if df is None:
+                return
+            with stage('normalize', table=table):
+                # also gives the data files the column names the catalog update would give them
+                yield normalization.apply(df)
 
-    for _email in emails:
-        try:
-            for _attachment in _email.get_attachments_email():
-                logger.info(f'Start process of {_attachment}')
-                my_attachment_instance = AttachmentParserInstance(parent_email=_email, attachment=_attachment)
-                try:
-                    df = my_attachment_instance.read_dataframe()
-                    logger.info(f'Data shape rows,cols :{df.shape}, column names {df.columns}')
-                    df.to_csv(f"/{TEMPORARY_LAMBDA_FOLDER}/{my_attachment_instance.attachment_filename}", index=False)
-                    # 2021-01-11 07:29:38 =>  20210111
-                    my_attachment_instance.push_attachment_in_curated(df)
-                except Exception as error:
-                    if str(error) == "UnknownExtension":
-                        quarantine_objects.append(_email)
-                        _email.push_email_in_quarantine()
-                        continue
-                    else:
-                        logger.critical(f"Unkown exception {error}")
-                        notify_team(str(error))
+    return checked_table(attachment_instance, table, chunks(), pandas_athena_types)
 
-        except Exception as error:
-            exc_type, exc_value, exc_tb = sys.exc_info()
-            logger.critical(traceback.format_exception(exc_type, exc_value, exc_tb))
-            logger.critical(f'Error in {_email.email_name} reading the s3 object {error}')
-            quarantine_objects.append(_email)
-            _email.push_email_in_quarantine()
 
-        logger.info(f'quarantine objects: {quarantine_objects}')
+def read_arrow_table(attachment_instance, table_chunks):
+    """`read_table` for the Arrow tables of the arrow CSV engine"""
+    table, read_chunks = table_chunks
+    normalization = attachment_instance.parent_email.normalization.for_table(table)
+    settled = settled_arrow_chunks(read_chunks, attachment_instance.schema_key(table))
+
+    def chunks():
+        while True:
+            with stage('dataframe_read', table=table, engine='arrow'):
+                arrow_table = next(settled, None)
+            if arrow_table is None:
+                return
+            with stage('normalize', table=table, engine='arrow'):
+                yield normalize_table(arrow_table, normalization)
+
+    return checked_table(attachment_instance, table, chunks(), lambda arrow_table: athena_types(arrow_table.schema))
+
+
+def pandas_athena_types(pandas_data_frame):
+    import awswrangler as wr  # type: ignore
+    return wr.catalog.extract_athena_types(df=pandas_data_frame, index=False)[0]
+
+
+def checked_table(attachment_instance, table, chunks, chunk_types):
+    """(table, chunks) once the Glue types of its first chunk are checked against the catalog"""
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        return table, iter(())
+    attachment_instance.update_catalog(table, chunk_types(first_chunk), plan_only=True)
+    return table, itertools.chain([first_chunk], chunks)
+
+
+def push_table(attachment_instance, table_chunks):
+    """Push the chunks of one table of an attachment, given by `read_table`, in curated and return the number of rows"""
+    table, chunks = table_chunks
+    rows = 0
+    for chunk_index, df in enumerate(chunks):
+        logger.info(f'Chunk of {table} shape rows,cols :{df.shape}, column names {list(df.columns)}')
+        attachment_instance.push_attachment_in_curated(df, table, chunk_index)
+        rows += len(df)
+    return rows
+
+
+def push_arrow_table(attachment_instance, table_chunks):
+    """`push_table` for the Arrow tables of the arrow CSV engine"""
+    table, chunks = table_chunks
+    rows = 0
+    for chunk_index, arrow_table in enumerate(chunks):
+        logger.info(f'Chunk of {table} shape rows,cols :{arrow_table.shape}, column names {arrow_table.column_names}')
+        attachment_instance.push_arrow_in_curated(arrow_table, table, chunk_index)
+        rows += arrow_table.num_rows
+    return rows
+
+
+def process_attachment(email, attachment):
+    """Process one attachment, failures are isolated from the other attachments of the email"""
+    my_attachment_instance = AttachmentParserInstance(parent_email=email, attachment=attachment)
+    logger.info(f"Start process of {attachment['filename']} ({attachment.get('mail_content_type')}, "
+                f"{attachment.get('size', 'unknown')} bytes) from {email.email_name}")
+    try:
+        # hashed before the tables are read, concurrently, from the same buffer
+        digest = content_digest(my_attachment_instance.open_content())
+        my_attachment_instance.write_id = hashlib.sha256(
+            f"{digest}/{email.email_key}/{my_attachment_instance.attachment_filename}".encode('utf-8')).hexdigest()
+        dedup_index = get_dedup_index(email.bucket_name)
+        attachment_key = my_attachment_instance.dedup_key(digest) if dedup_index is not None else None
+        if attachment_key is not None and dedup_index.seen(attachment_key):
+            logger.info(f'{my_attachment_instance.attachment_filename} of {email.email_name} already processed '
+                        f'(dedup key {attachment_key}), skipped')
+            return True
+        with my_attachment_instance.open_tables() as tables:
+            if my_attachment_instance.arrow_engine:
+                read, push = read_arrow_table, push_arrow_table
+            else:
+                read, push = read_table, push_table
+            # every table is checked against the catalog before the first one is written
+            tables = run_concurrently(partial(read, my_attachment_instance), tables, max_workers=MAX_CONCURRENT_SHEETS)
+            rows = sum(run_concurrently(partial(push, my_attachment_instance), tables,
+                                        max_workers=MAX_CONCURRENT_SHEETS))
+        logger.info(f'{rows} rows of {my_attachment_instance.attachment_filename} in {len(tables)} tables '
+                    f'pushed in curated')
+        my_attachment_instance.push_original_attachment()
+        if attachment_key is not None:
+            dedup_index.mark(attachment_key)
+    except Exception as error:
+        if is_retryable(error):
+            raise
+        if str(error) in ("UnknownExtension", "WorkbookTooLarge", "SchemaMismatch"):
+            email.push_email_in_quarantine(str(error))
+            return False
+        else:
+            logger.critical(f"Unkown exception {error}")
+            notify_team(str(error))
+    return True
+
+
+def process_email(paths):
+    """
+    Process all the attachments of one S3 record.
+    Returns the email if it has been pushed in quarantine, None otherwise. Retryable errors are raised.
+    """
+    _email = EmailParserInstance(paths=paths)
+    try:
+        results = run_concurrently(partial(process_attachment, _email),
+                                   _email.get_attachments_email(),
+                                   max_workers=MAX_CONCURRENT_ATTACHMENTS)
+        if not all(results):
+            return _email
+    except Exception as error:
+        if is_retryable(error):
+            raise
+        exc_type, exc_value, exc_tb = sys.exc_info()
+        logger.critical(traceback.format_exception(exc_type, exc_value, exc_tb))
+        logger.critical(f'Error in {_email.email_name} reading the s3 object {error}')
+        _email.push_email_in_quarantine(f'{type(error).__name__} {error}')
+        return _email
+    return None
+
+
+def s3_records(event):
+    """
+    (SQS message id, S3 record) of every S3 notification of the event, received directly or buffered in SQS.
+    The message id is None for a direct S3 notification.
+    """
+    for record in event['Records']:
+        if record.get('eventSource') == 'aws:sqs':
+            # s3:TestEvent messages have no records
+            for s3_record in json.loads(record['body']).get('Records', []):
+                yield record['messageId'], s3_record
+        else:
+            yield None, record
+
+
+def load_and_process_email(message_record):
+    message_id, paths = message_record
+    try:
+        return message_id, process_email(paths), None
+    except Exception as error:
+        logger.critical(f"Failed to load or process {paths['s3']['object']['key']} {error}")
+        return message_id, None, error
+
+
+@profiled
+def lambda_handler(event, context):
+    records = list(s3_records(event))
+    logger.info(f"event with {len(event['Records'])} records, {len(records)} emails")
+
+    results = run_concurrently(load_and_process_email, records, max_workers=MAX_CONCURRENT_EMAILS)
+    quarantine_objects = [_email.email_name for _, _email, _ in results if _email is not None]
+    logger.info(f'quarantine objects: {quarantine_objects}')
+
+    if any(record.get('eventSource') == 'aws:sqs' for record in event['Records']):
+        # only the messages of the emails that could not be loaded, or hit a retryable error, go back to the queue
+        failed_message_ids = sorted({message_id for message_id, _, error in results if error is not None})
+        return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]}
+    errors = [error for _, _, error in results if error is not None]
+    if errors:
+        # let Lambda retry the invocation when a raw email could not be loaded or processed
+        raise errors[0]
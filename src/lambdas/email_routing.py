@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import re
+from urllib.parse import unquote_plus
+
+import boto3
+
+s3_client = boto3.client('s3')
+sqs_client = boto3.client('sqs')
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Emails up to these sizes go to the small and medium processors, larger ones to the large processor
+SMALL_MAX_EMAIL_BYTES = int(os.environ.get('SMALL_MAX_EMAIL_BYTES', 5 * 1024 * 1024))
+MEDIUM_MAX_EMAIL_BYTES = int(os.environ.get('MEDIUM_MAX_EMAIL_BYTES', 50 * 1024 * 1024))
+# Bytes of the raw email read to find the MIME headers of its parts
+ROUTING_PEEK_BYTES = int(os.environ.get('ROUTING_PEEK_BYTES', 64 * 1024))
+# A workbook expands several times once its zipped sheets are read, it weighs more than its size in the email
+WORKBOOK_SIZE_FACTOR = float(os.environ.get('WORKBOOK_SIZE_FACTOR', 4))
+TIERS = ('small', 'medium', 'large')
+WORKBOOK_PART = re.compile(rb'spreadsheetml|ms-excel|filename\*?=\s*"?[^"\r\n]*\.xlsx?\b', re.IGNORECASE)
+
+
+def notify_team(error='error'):
+    logger.critical(f"notify team with error {error}")
+
+
+def queue_urls():
+    return {tier: os.environ.get(f'PROCESSING_QUEUE_{tier.upper()}_URL') for tier in TIERS}
+
+
+def has_workbook(bucket_name, key):
+    """Whether the MIME headers of the first ROUTING_PEEK_BYTES of the email announce an Excel attachment"""
+    response = s3_client.get_object(Bucket=bucket_name, Key=key, Range=f'bytes=0-{ROUTING_PEEK_BYTES - 1}')
+    return WORKBOOK_PART.search(response['Body'].read()) is not None
+
+
+def email_tier(size, workbook=False):
+    weight = size * WORKBOOK_SIZE_FACTOR if workbook else size
+    if weight <= SMALL_MAX_EMAIL_BYTES:
+        return 'small'
+    if weight <= MEDIUM_MAX_EMAIL_BYTES:
+        return 'medium'
+    return 'large'
+
+
+def record_tier(s3_record):
+    bucket_name = s3_record['s3']['bucket']['name']
+    # keys are url encoded in the S3 notifications
+    key = unquote_plus(s3_record['s3']['object']['key'])
+    size = s3_record['s3']['object'].get('size')
+    if size is None:
+        size = s3_client.head_object(Bucket=bucket_name, Key=key)['ContentLength']
+    # a workbook can only move an email up one tier, no need to look for one in the largest emails
+    workbook = email_tier(size) != 'large' and has_workbook(bucket_name, key)
+    tier = email_tier(size, workbook)
+    logger.info(f'{key} of {size} bytes, workbook: {workbook} => {tier} processor')
+    return tier
+
+
+def lambda_handler(event, context):
+    """Forward every message of the raw emails queue to the queue of the processor sized for the email"""
+    logger.info(f"event with {len(event['Records'])} records")
+    urls = queue_urls()
+    entries = {tier: [] for tier in TIERS}
+    failed_message_ids = []
+    for record in event['Records']:
+        try:
+            s3_records = json.loads(record['body']).get('Records', [])
+            if not s3_records:
+                # s3:TestEvent
+                continue
+            tier = max((record_tier(s3_record) for s3_record in s3_records), key=TIERS.index)
+            entries[tier].append({'Id': record['messageId'], 'MessageBody': record['body']})
+        except Exception as error:
+            logger.critical(f"Failed to route message {record['messageId']} {error}")
+            failed_message_ids.append(record['messageId'])
+    for tier, tier_entries in entries.items():
+        for start in range(0, len(tier_entries), 10):
+            try:
+                response = sqs_client.send_message_batch(QueueUrl=urls[tier], Entries=tier_entries[start:start + 10])
+            except Exception as error:
+                logger.critical(f"Failed to forward messages to the {tier} processor {error}")
+                failed_message_ids.extend(entry['Id'] for entry in tier_entries[start:start + 10])
+                continue
+            failed_message_ids.extend(failure['Id'] for failure in response.get('Failed', []))
+    if failed_message_ids:
+        notify_team(f"routing_failed {failed_message_ids}")
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]}
@@ -0,0 +1,51 @@
+from fnmatch import fnmatch
+
+DEFAULT_REJECTED_VERDICTS = {"spam": ["FAIL"], "virus": ["FAIL"], "spf": [], "dkim": [], "dmarc": []}
+DEFAULT_ATTACHMENT_CONTENT_TYPES = ["multipart/*", "application/*", "text/csv"]
+
+
+class FilteringRules:
+    """
+    Early rejection rules of the FILTERING_RULES configuration, evaluated on the SES receipt event only,
+    before the email is written in S3:
+        * "REJECTED_VERDICTS": {"spam": ["FAIL"], "virus": ["FAIL"], "spf": ["FAIL"], "dkim": [], "dmarc": []}
+          statuses of the SES verdicts that reject the email. Spam and virus verdicts need the scan of the rule.
+        * "ATTACHMENT_CONTENT_TYPES": ["multipart/*", "application/*", "text/csv"]
+          top level content types of the emails that can have an attachment, an empty list accepts any email.
+          Any multipart type is kept: attachments are also sent in multipart/alternative, related or signed
+          emails, and a rejected email is never written in S3.
+    """
+
+    def __init__(self, rejected_verdicts=None, attachment_content_types=None):
+        rejected_verdicts = DEFAULT_REJECTED_VERDICTS if rejected_verdicts is None else rejected_verdicts
+        self.rejected_verdicts = {f'{verdict.lower()}Verdict': {status.upper() for status in statuses}
+                                  for verdict, statuses in rejected_verdicts.items()}
+        self.attachment_content_types = [content_type.lower() for content_type in (
+            DEFAULT_ATTACHMENT_CONTENT_TYPES if attachment_content_types is None else attachment_content_types)]
+
+    @classmethod
+    def from_config(cls, email_configuration):
+        rules = email_configuration.get("FILTERING_RULES", {})
+        return cls(rules.get("REJECTED_VERDICTS"), rules.get("ATTACHMENT_CONTENT_TYPES"))
+
+    def rejection_reason(self, ses_event):
+        """Why the email of an SES receipt event is rejected, None when it is accepted"""
+        receipt = ses_event.get('receipt', {})
+        for verdict, statuses in self.rejected_verdicts.items():
+            status = receipt.get(verdict, {}).get('status', '').upper()
+            if status in statuses:
+                return f'{verdict}_{status}'
+        if self.attachment_content_types:
+            content_type = content_type_header(ses_event['mail'])
+            # without the header the email is kept, the processing decides
+            if content_type and not any(fnmatch(content_type, pattern) for pattern in self.attachment_content_types):
+                return f'no_attachment_{content_type}'
+        return None
+
+
+def content_type_header(mail):
+    """Top level content type of the email, from the headers SES passes in the event"""
+    for header in mail.get('headers', []):
+        if header.get('name', '').lower() == 'content-type':
+            return header.get('value', '').split(';')[0].strip().lower()
+    return None
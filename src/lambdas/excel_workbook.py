@@ -0,0 +1,88 @@
+import zipfile
+
+
+def open_workbook(content):
+    """
+    Open an xlsx workbook in read-only mode: the rows are streamed from the archive instead of building
+    the whole workbook object model. The sheets of one read-only workbook can be read by concurrent threads,
+    every iteration opens its own stream of the archive.
+    """
+    import openpyxl  # type: ignore
+    content.seek(0)
+    return openpyxl.load_workbook(content, read_only=True, data_only=True)
+
+
+def worksheets_uncompressed_size(content):
+    """Size in bytes of the sheets and shared strings once decompressed, read from the archive directory only"""
+    content.seek(0)
+    with zipfile.ZipFile(content) as archive:
+        size = sum(member.file_size for member in archive.infolist()
+                   if member.filename.startswith('xl/worksheets/') or member.filename == 'xl/sharedStrings.xml')
+    content.seek(0)
+    return size
+
+
+def workbook_rows(workbook, limit):
+    """
+    Rows of every sheet, from the dimension it declares or else by reading it. Reading stops past `limit` rows
+    in all, so that a too large workbook is rejected before any of its sheets is converted.
+    """
+    rows = 0
+    for worksheet in workbook.worksheets:
+        if worksheet.max_row is not None:
+            rows += worksheet.max_row
+            continue
+        for _ in worksheet.iter_rows(values_only=True):
+            rows += 1
+            if rows > limit:
+                break
+        if rows > limit:
+            break
+    return rows
+
+
+def workbook_size_error(workbook, content, max_rows, max_bytes):
+    """Reason why a workbook is too large to be converted, None when it is not. 0 disables a limit."""
+    if max_bytes > 0:
+        size = worksheets_uncompressed_size(content)
+        if size > max_bytes:
+            return f'{size} uncompressed bytes, limit {max_bytes}'
+    if max_rows > 0:
+        rows = workbook_rows(workbook, max_rows)
+        if rows > max_rows:
+            return f'{rows} rows, limit {max_rows}'
+    return None
+
+
+def iter_sheet_chunks(worksheet, chunk_rows, max_rows=0):
+    """
+    Yield the rows of a sheet as DataFrames of at most `chunk_rows` rows, the first row is the header.
+    Raise `Exception('WorkbookTooLarge')` past `max_rows` rows, for sheets whose declared dimension is wrong.
+    Rows are padded to the width of the sheet, the cells beyond the header are in `Unnamed: n` columns as with
+    `pd.read_excel`.
+    """
+    import pandas as pd  # type: ignore
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    if worksheet.max_column is None:
+        # without a declared dimension every row has its own length, the sheet is sized once to pad them
+        worksheet.calculate_dimension(force=True)
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows)
+    columns = [str(column) if column is not None else f'Unnamed: {index}' for index, column in enumerate(header)]
+    batch = []
+    read_rows = 0
+    for row in rows:
+        if all(value is None for value in row):
+            continue
+        read_rows += 1
+        if 0 < max_rows < read_rows:
+            raise Exception('WorkbookTooLarge')
+        batch.append(row)
+        if chunk_rows > 0 and len(batch) >= chunk_rows:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+            batch = []
+    if batch:
+        yield pd.DataFrame.from_records(batch, columns=columns)
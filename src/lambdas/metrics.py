@@ -0,0 +1,133 @@
+import functools
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'EmailIntegration')
+# Fraction of the invocations run under the sampling profiler, 0 disables it
+PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+PROFILER_INTERVAL_SECONDS = float(os.environ.get('PROFILER_INTERVAL_SECONDS', 0.005))
+PROFILER_TOP_FUNCTIONS = int(os.environ.get('PROFILER_TOP_FUNCTIONS', 25))
+
+logger = logging.getLogger()
+# stages run on pool threads, a record and its newline must reach stdout in one write
+emit_lock = threading.Lock()
+
+
+def peak_memory_mb():
+    # ru_maxrss is the high-water mark of the process, in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def emit_metrics(dimensions, metrics, properties=None):
+    """
+    Write one CloudWatch Embedded Metric Format record on stdout.
+    EMF records must be written as raw JSON lines, which the Lambda logging handler would prefix.
+    """
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()],
+            }],
+        },
+        **(properties or {}),
+        **dimensions,
+        **{name: value for name, (value, _) in metrics.items()},
+    }
+    line = json.dumps(record, default=str) + '\n'
+    with emit_lock:
+        sys.stdout.write(line)
+
+
+@contextmanager
+def stage(name, **properties):
+    """
+    Emit the duration of a pipeline stage, `properties` are searchable only. PeakMemory is the high-water mark of
+    the whole process when the stage ends: stages run concurrently on pool threads and the mark never goes down,
+    so the memory used by one stage can not be told apart from the others.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        emit_metrics({'Stage': name},
+                     {'Duration': (round(duration_ms, 3), 'Milliseconds'),
+                      'PeakMemory': (round(peak_memory_mb(), 1), 'Megabytes')},
+                     properties)
+
+
+class SamplingProfiler:
+    """
+    Sample the stacks of all the threads every `interval` seconds from a background thread.
+    Unlike cProfile it also sees the worker threads of the thread pools, at a cost bounded by the interval.
+    """
+
+    def __init__(self, interval=PROFILER_INTERVAL_SECONDS):
+        self.interval = interval
+        self.self_samples = Counter()
+        self.total_samples = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                self.samples += 1
+                seen = set()
+                leaf = True
+                while frame is not None:
+                    code = frame.f_code
+                    function = f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+                    if leaf:
+                        self.self_samples[function] += 1
+                        leaf = False
+                    if function not in seen:
+                        self.total_samples[function] += 1
+                        seen.add(function)
+                    frame = frame.f_back
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, top=PROFILER_TOP_FUNCTIONS):
+        lines = [f'sampling profile: {self.samples} samples every {self.interval}s',
+                 'self%   total%  function']
+        for function, total in self.total_samples.most_common(top):
+            lines.append(f'{100 * self.self_samples[function] / max(self.samples, 1):5.1f}  '
+                         f'{100 * total / max(self.samples, 1):6.1f}  {function}')
+        return '\n'.join(lines)
+
+
+def profiled(handler):
+    """Run a sample of the invocations of a Lambda handler under the sampling profiler"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if PROFILER_SAMPLE_RATE <= 0 or random.random() >= PROFILER_SAMPLE_RATE:
+            return handler(event, context)
+        profiler = SamplingProfiler()
+        try:
+            with profiler:
+                return handler(event, context)
+        finally:
+            logger.info(profiler.report())
+    return wrapper
@@ -0,0 +1,101 @@
+import binascii
+import tempfile
+from datetime import timezone
+from email import policy
+from email.feedparser import BytesFeedParser
+from email.header import decode_header, make_header
+from email.utils import getaddresses, parsedate_to_datetime
+
+TEMPORARY_LAMBDA_FOLDER = "tmp"
+BASE64_DECODE_CHUNK_CHARS = 4 * 64 * 1024
+
+
+class StreamedEmail:
+    """
+    Incremental replacement of `mailparser.MailParser` for the attributes used by the email processing.
+
+    The raw email is fed to the MIME parser chunk by chunk, so the whole S3 object is never held as
+    one bytes buffer. Every attachment is decoded once, chunk by chunk, into a spooled buffer that stays
+    in memory up to `spool_max_size` bytes and spills to the Lambda /tmp folder beyond it. The encoded
+    payload of a part is released as soon as it has been decoded.
+    """
+
+    def __init__(self, message, spool_max_size):
+        self.message = message
+        self.spool_max_size = spool_max_size
+
+    @classmethod
+    def from_stream(cls, body, chunk_size, spool_max_size):
+        parser = BytesFeedParser(policy=policy.compat32)
+        for chunk in body.iter_chunks(chunk_size):
+            parser.feed(chunk)
+        return cls(parser.close(), spool_max_size)
+
+    @property
+    def from_(self):
+        return getaddresses(self.message.get_all('from', []))
+
+    @property
+    def to(self):
+        return getaddresses(self.message.get_all('to', []))
+
+    @property
+    def date(self):
+        # Same representation as mailparser: naive datetime in UTC
+        date_header = self.message.get('date')
+        if date_header is None:
+            return None
+        date = parsedate_to_datetime(date_header)
+        if date.tzinfo is not None:
+            date = date.astimezone(timezone.utc).replace(tzinfo=None)
+        return date
+
+    @property
+    def attachments(self):
+        for part_index, part in enumerate(self.message.walk()):
+            filename = part_filename(part)
+            if part.is_multipart() or not filename:
+                continue
+            content = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size,
+                                                    dir=f"/{TEMPORARY_LAMBDA_FOLDER}")
+            size = decode_part(part, content)
+            part.set_payload('')
+            content.seek(0)
+            yield {
+                'filename': filename,
+                'mail_content_type': part.get_content_type(),
+                'charset': part.get_content_charset(),
+                'content': content,
+                'size': size,
+                # position of the part in `email.message.Message.walk()` order, to find it back in the raw email
+                'part_index': part_index,
+            }
+
+
+def part_filename(part):
+    """
+    Filename of a MIME part as mailparser gives it: compat32 decodes RFC 2231 parameters but leaves
+    the RFC 2047 encoded-words that Outlook and Gmail use for non ASCII names.
+    """
+    filename = part.get_filename()
+    if not filename:
+        return filename
+    return str(make_header(decode_header(filename)))
+
+
+def decode_part(part, output):
+    """Write the decoded payload of a non multipart MIME part into `output` and return its size."""
+    encoding = str(part.get('content-transfer-encoding', '')).strip().lower()
+    if encoding != 'base64':
+        return output.write(part.get_payload(decode=True) or b'')
+    encoded = part.get_payload()
+    size = 0
+    remainder = ''
+    for start in range(0, len(encoded), BASE64_DECODE_CHUNK_CHARS):
+        chunk = remainder + ''.join(encoded[start:start + BASE64_DECODE_CHUNK_CHARS].split())
+        cut = len(chunk) - len(chunk) % 4
+        remainder = chunk[cut:]
+        size += output.write(binascii.a2b_base64(chunk[:cut]))
+    if remainder:
+        size += output.write(binascii.a2b_base64(remainder + '=' * (-len(remainder) % 4)))
+    return size
@@ -0,0 +1,117 @@
+NUMERIC_TYPES = {
+    'integer': 'Int64', 'int64': 'Int64', 'int32': 'Int32', 'int16': 'Int16', 'int8': 'Int8',
+    'number': 'float64', 'double': 'float64', 'float64': 'float64', 'float': 'float32', 'float32': 'float32',
+}
+BOOLEAN_VALUES = {'true': True, 'yes': True, 'y': True, '1': True, 'false': False, 'no': False, 'n': False, '0': False}
+
+
+def table_key(table):
+    # attachment tables are slugs, the Glue tables have underscores: both spellings are accepted
+    return table.replace('-', '_').lower()
+
+
+class TableNormalization:
+    """
+    Vectorized cleaning of the chunks of one curated table, before they are written in parquet.
+
+    `columns` declares the type of some columns by their sanitized name, the name they have in Athena:
+        {"amount": {"type": "number", "thousands": ",", "decimal": "."},
+         "quantity": {"type": "int32"},
+         "order_date": {"type": "date", "format": "%d/%m/%Y"},
+         "country": {"type": "category"}}
+    Values that can not be parsed, or do not fit the declared integer type, become nulls. The undeclared float columns are downcast to float32 with
+    `downcast_floats`, and the undeclared string columns become dictionary encoded categoricals when their
+    ratio of distinct values is at most `categorical_max_ratio`. Both keep the same Athena type from one chunk
+    to the other; integers are not downcast automatically as the next chunk could overflow the narrower type.
+    """
+
+    def __init__(self, columns=None, downcast_floats=False, categorical_max_ratio=0.0):
+        self.columns = columns or {}
+        self.downcast_floats = downcast_floats
+        self.categorical_max_ratio = categorical_max_ratio
+
+    @classmethod
+    def from_config(cls, table_configuration):
+        return cls(columns={column.lower(): rule for column, rule in table_configuration.get('columns', {}).items()},
+                   downcast_floats=table_configuration.get('downcast_floats', False),
+                   categorical_max_ratio=float(table_configuration.get('categorical_max_ratio', 0.0)))
+
+    def apply(self, pandas_data_frame):
+        import awswrangler as wr  # type: ignore
+        # the declared columns and the catalog use the sanitized names
+        pandas_data_frame = wr.catalog.sanitize_dataframe_columns_names(df=pandas_data_frame)
+        for column in pandas_data_frame.columns:
+            rule = self.columns.get(column)
+            series = pandas_data_frame[column]
+            if rule is not None:
+                pandas_data_frame[column] = cast_column(series, rule)
+            elif self.downcast_floats and series.dtype == 'float64':
+                pandas_data_frame[column] = series.astype('float32')
+            elif self.categorical_max_ratio > 0 and is_low_cardinality(series, self.categorical_max_ratio):
+                pandas_data_frame[column] = series.astype('category')
+        return pandas_data_frame
+
+
+def is_low_cardinality(series, max_ratio):
+    if series.dtype.kind != 'O' and str(series.dtype) != 'string':
+        return False
+    return len(series) > 0 and series.nunique(dropna=True) <= max_ratio * len(series)
+
+
+def parse_numbers(series, thousands=None, decimal=None):
+    import pandas as pd  # type: ignore
+    if series.dtype.kind not in 'biuf':
+        series = series.astype('string').str.strip()
+        if thousands:
+            series = series.str.replace(thousands, '', regex=False)
+        if decimal and decimal != '.':
+            series = series.str.replace(decimal, '.', regex=False)
+    return pd.to_numeric(series, errors='coerce')
+
+
+def representable_integers(numbers, integer_type):
+    """Fractional values and overflows become nulls, nullable integer casts would raise on them"""
+    import numpy as np  # type: ignore
+    bounds = np.iinfo(integer_type.lower())
+    return numbers.where((numbers >= bounds.min) & (numbers <= bounds.max) & (numbers % 1 == 0))
+
+
+def cast_column(series, rule):
+    import pandas as pd  # type: ignore
+    column_type = rule.get('type', 'string').lower()
+    if column_type in NUMERIC_TYPES:
+        numbers = parse_numbers(series, rule.get('thousands'), rule.get('decimal'))
+        if NUMERIC_TYPES[column_type].startswith('Int'):
+            numbers = representable_integers(numbers, NUMERIC_TYPES[column_type])
+        return numbers.astype(NUMERIC_TYPES[column_type])
+    if column_type in ('date', 'timestamp'):
+        if series.dtype.kind == 'M':
+            return series
+        return pd.to_datetime(series.astype('string').str.strip(), format=rule.get('format'),
+                              dayfirst=rule.get('dayfirst', False), errors='coerce')
+    if column_type == 'boolean':
+        if series.dtype.kind == 'b':
+            return series.astype('boolean')
+        return series.astype('string').str.strip().str.lower().map(BOOLEAN_VALUES).astype('boolean')
+    if column_type == 'category':
+        return series.astype('string').astype('category')
+    return series.astype('string')
+
+
+class Normalization:
+    """NORMALIZATION of config/email.json: a DEFAULT normalization and one per table in TABLES, by table name"""
+
+    def __init__(self, default, tables):
+        self.default = default
+        self.tables = tables
+
+    @classmethod
+    def from_config(cls, email_configuration):
+        normalization = email_configuration.get('NORMALIZATION', {})
+        default = normalization.get('DEFAULT', {})
+        return cls(TableNormalization.from_config(default),
+                   {table_key(table): TableNormalization.from_config({**default, **table_configuration})
+                    for table, table_configuration in normalization.get('TABLES', {}).items()})
+
+    def for_table(self, table):
+        return self.tables.get(table_key(table), self.default)
@@ -0,0 +1,55 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from botocore.exceptions import ClientError  # type: ignore
+
+logger = logging.getLogger()
+
+PROJECT_TAGS = {"Project": "EmailIntegration"}
+# S3 can answer NoSuchKey for a few moments after a write on some code paths, and throttles bursts of tagging calls.
+# Unlike the errors that send an email back to the queue in email_processing, a missing object is retried here.
+TAGGING_RETRY_ERROR_CODES = ('NoSuchKey', 'SlowDown', 'Throttling', 'ThrottlingException', 'RequestTimeout',
+                             'InternalError', 'ServiceUnavailable')
+
+
+def tagging_header(tags=None):
+    """Tags in the URL query format expected by the `Tagging` argument of PutObject, CopyObject and uploads"""
+    return urlencode(PROJECT_TAGS if tags is None else tags)
+
+
+def tag_set(tags=None):
+    return [{'Key': key, 'Value': value} for key, value in (PROJECT_TAGS if tags is None else tags).items()]
+
+
+def put_object_tagging_with_retry(s3_client, bucket_name, key, tags=None, max_attempts=5, base_delay=0.1):
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return s3_client.put_object_tagging(Bucket=bucket_name, Key=key, Tagging={'TagSet': tag_set(tags)})
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') not in TAGGING_RETRY_ERROR_CODES or attempt == max_attempts:
+                raise
+            # exponential backoff with full jitter
+            time.sleep(random.uniform(0, base_delay * 2 ** (attempt - 1)))
+
+
+def tag_objects(s3_client, bucket_name, keys, tags=None, max_workers=8, max_attempts=5, base_delay=0.1):
+    """
+    Tag a batch of objects concurrently, for objects that could not be tagged when written.
+    Returns the list of keys that could not be tagged.
+    """
+    def _tag(key):
+        try:
+            put_object_tagging_with_retry(s3_client, bucket_name, key, tags, max_attempts, base_delay)
+        except ClientError as error:
+            logger.error(f'put_object_tagging s3://{bucket_name}/{key} {error}')
+            return key
+        return None
+
+    keys = list(keys)
+    if not keys:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+        return [key for key in executor.map(_tag, keys) if key is not None]
@@ -0,0 +1,54 @@
+from email.utils import parseaddr
+
+
+class SenderAllowList:
+    """
+    Precompiled matcher for the ACCEPTED_SENDERS configuration.
+
+    Entries are split into three indexes so that a lookup costs a set membership test per
+    label of the sender domain, whatever the size of the allow-list:
+        * "user@domain.com"                  -> exact address
+        * "domain.com", "@domain.com"         -> any address of that domain
+        * "*.domain.com", "*@*.domain.com"    -> any address of a sub-domain of domain.com
+    """
+
+    def __init__(self, entries):
+        self.addresses = set()
+        self.domains = set()
+        self.wildcard_domains = set()
+        for entry in entries:
+            self.add(entry)
+
+    @classmethod
+    def from_config(cls, email_configuration):
+        accepted_senders = email_configuration.get("ACCEPTED_SENDERS", "")
+        if isinstance(accepted_senders, str):
+            accepted_senders = accepted_senders.split(',')
+        return cls(accepted_senders)
+
+    def add(self, entry):
+        entry = entry.strip().lower()
+        if not entry:
+            return
+        local_part, _, domain = entry.rpartition('@')
+        if local_part and local_part != '*':
+            self.addresses.add(entry)
+        elif domain.startswith('*.'):
+            self.wildcard_domains.add(domain[2:])
+        else:
+            self.domains.add(domain)
+
+    def __len__(self):
+        return len(self.addresses) + len(self.domains) + len(self.wildcard_domains)
+
+    def is_accepted(self, email_source):
+        address = parseaddr(email_source)[1].strip().lower()
+        if not address:
+            return False
+        if address in self.addresses:
+            return True
+        domain = address.rpartition('@')[2]
+        if domain in self.domains:
+            return True
+        labels = domain.split('.')
+        return any('.'.join(labels[index:]) in self.wildcard_domains for index in range(1, len(labels)))
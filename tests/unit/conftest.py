@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The Lambda handlers are shipped as flat modules in the container image
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src', 'lambdas'))
+# Modules of the handlers create their boto3 clients when imported, tests run them against moto
+for name, value in {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "testing",
+                    "AWS_SECRET_ACCESS_KEY": "testing"}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,33 @@
+import io
+
+from arrow_csv import athena_types, cast_columns, iter_csv_tables, normalize_table
+from normalization import TableNormalization
+
+CSV = ("Id,Label,Amount,Day,Empty\n" + "".join(f"{row},label_{row % 3},{row / 2},2021-01-0{row % 9 + 1},\n"
+                                              for row in range(1000))).encode("latin-1")
+
+
+def test_csv_is_read_in_tables_with_the_pandas_engine_types():
+    tables = list(iter_csv_tables(io.BytesIO(CSV), "latin-1", chunk_rows=300, block_size=4096))
+    assert sum(table.num_rows for table in tables) == 1000 and len(tables) > 1
+    assert athena_types(tables[0].schema) == {"Id": "bigint", "Label": "string", "Amount": "double",
+                                              "Day": "string", "Empty": "string"}
+    assert str(next(iter_csv_tables(io.BytesIO(CSV), "latin-1", 0, schema={"Id": "float64"})).schema.field("Id").type) \
+        == "double"
+
+
+def test_normalization_of_arrow_tables():
+    table = next(iter_csv_tables(io.BytesIO(CSV), "latin-1", chunk_rows=0))
+    normalized = normalize_table(table, TableNormalization(downcast_floats=True, categorical_max_ratio=0.1))
+    assert normalized.column_names == ["id", "label", "amount", "day", "empty"]
+    assert athena_types(normalized.schema) == {"id": "bigint", "label": "string", "amount": "float",
+                                               "day": "string", "empty": "string"}
+    assert str(normalized.schema.field("label").type).startswith("dictionary")
+
+
+def test_columns_are_cast_to_glue_types():
+    table = next(iter_csv_tables(io.BytesIO(CSV), "latin-1", chunk_rows=0))
+    cast = cast_columns(table, {"Id": "string", "Amount": "string", "Missing": "bigint"})
+    assert athena_types(cast.schema) == {"Id": "string", "Label": "string", "Amount": "string", "Day": "string",
+                                         "Empty": "string"}
+    assert cast.column("Id")[1].as_py() == "1"
@@ -0,0 +1,55 @@
+from catalog_cache import (CatalogWriteCache, MemoryFingerprintStore, catalog_casts, catalog_conflict,
+                           catalog_describes, schema_fingerprint)
+
+
+def test_fingerprint_changes_with_schema_drift():
+    fingerprint = schema_fingerprint({"a": "bigint", "b": "string"}, parameters={"sender": "a@b.com"})
+    assert fingerprint == schema_fingerprint({"b": "string", "a": "bigint"}, parameters={"sender": "a@b.com"})
+    assert fingerprint != schema_fingerprint({"a": "double", "b": "string"}, parameters={"sender": "a@b.com"})
+
+
+def test_shared_store_is_used_by_a_cold_cache():
+    store = MemoryFingerprintStore()
+    CatalogWriteCache(store).remember("db", "table", "fingerprint")
+    cold_cache = CatalogWriteCache(store)
+    assert cold_cache.is_current("db", "table", "fingerprint")
+    assert not cold_cache.is_current("db", "table", "other_fingerprint")
+    assert not CatalogWriteCache(store, ttl_seconds=0).is_current("db", "table", "fingerprint")
+
+
+def test_appends_conflicting_with_the_table_types():
+    glue_table = {"Name": "orders_csv", "StorageDescriptor": {"Columns": [{"Name": "id", "Type": "bigint"}]}}
+    assert catalog_conflict(None, {"id": "string"}) is None
+    assert catalog_conflict(glue_table, {"id": "bigint", "label": "string"}) is None
+    assert catalog_conflict(glue_table, {"id": "string"}) == "column types of orders_csv changed: id bigint => string"
+
+
+def test_only_a_table_holding_the_requested_types_describes_them():
+    glue_table = {"Name": "orders_csv", "StorageDescriptor": {"Columns": [{"Name": "id", "Type": "bigint"}]}}
+    assert catalog_describes(glue_table, {"id": "bigint"})
+    assert not catalog_describes(glue_table, {"id": "string"})
+    assert not catalog_describes(glue_table, {"id": "bigint", "label": "string"})
+    assert not catalog_describes(None, {"id": "bigint"})
+
+
+def test_appends_to_a_table_partitioned_otherwise_conflict():
+    glue_table = {"Name": "orders_csv", "StorageDescriptor": {"Columns": [{"Name": "id", "Type": "bigint"}]},
+                  "PartitionKeys": []}
+    partitions_types = {"email_received_date": "string"}
+    assert "partition keys of orders_csv are []" in catalog_conflict(glue_table, {"id": "bigint"}, partitions_types)
+    assert not catalog_describes(glue_table, {"id": "bigint"}, partitions_types)
+    glue_table["PartitionKeys"] = [{"Name": "email_received_date", "Type": "string"}]
+    assert catalog_conflict(glue_table, {"id": "bigint"}, partitions_types) is None
+    assert catalog_describes(glue_table, {"id": "bigint"}, partitions_types)
+
+
+def test_appends_are_cast_to_wider_table_types():
+    glue_table = {"Name": "orders_csv", "StorageDescriptor": {"Columns": [{"Name": "code", "Type": "string"},
+                                                                         {"Name": "amount", "Type": "double"}]}}
+    columns_types = {"code": "bigint", "amount": "bigint", "label": "string"}
+    assert catalog_casts(glue_table, columns_types) == {"code": "string", "amount": "double"}
+    assert catalog_conflict(glue_table, columns_types) is None
+    assert catalog_conflict(glue_table, {"amount": "string"}) is not None
+    store = MemoryFingerprintStore()
+    CatalogWriteCache(store).remember("db", "table", "fingerprint", {"code": "string"})
+    assert CatalogWriteCache(store).current_entry("db", "table", "fingerprint")["cast_types"] == {"code": "string"}
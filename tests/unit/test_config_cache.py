@@ -0,0 +1,121 @@
+import io
+import json
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+import config_cache
+from config_cache import S3ConfigCache
+
+BUCKET_NAME = "email-integration-test"
+CONFIG_PARSER_KEY = "config/email.json"
+
+
+class StubS3Client:
+    """One configuration object, answering the conditional GETs on its ETag with a 304 as S3 does"""
+
+    def __init__(self, configuration):
+        self.requests = []
+        self.version = 0
+        self.put(configuration)
+
+    def put(self, configuration):
+        self.body = json.dumps(configuration).encode("utf-8")
+        self.version += 1
+        self.etag = f'"version-{self.version}"'
+
+    def get_object(self, **request):
+        self.requests.append(request)
+        if request.get("IfNoneMatch") == self.etag:
+            raise ClientError({"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject")
+        return {"Body": io.BytesIO(self.body), "ETag": self.etag}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(config_cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_configuration_is_revalidated_once_per_ttl(clock):
+    s3_client = StubS3Client({"ACCEPTED_SENDERS": "a@server.com"})
+    cache = S3ConfigCache(s3_client, BUCKET_NAME, CONFIG_PARSER_KEY, ttl_seconds=60)
+    built = []
+
+    def senders(configuration):
+        built.append(configuration)
+        return configuration["ACCEPTED_SENDERS"]
+
+    assert cache.derived(senders) == "a@server.com"
+    clock[0] += 59
+    assert cache.derived(senders) == "a@server.com"
+    assert s3_client.requests == [{"Bucket": BUCKET_NAME, "Key": CONFIG_PARSER_KEY}]
+
+    # past the TTL the object is revalidated on its ETag, a 304 keeps the parsed configuration and derived values
+    clock[0] += 1
+    assert cache.derived(senders) == "a@server.com"
+    assert s3_client.requests[-1] == {"Bucket": BUCKET_NAME, "Key": CONFIG_PARSER_KEY, "IfNoneMatch": s3_client.etag}
+    assert len(s3_client.requests) == 2 and len(built) == 1
+
+    # a new ETag reloads the configuration and rebuilds the derived values, once
+    s3_client.put({"ACCEPTED_SENDERS": "b@server.com"})
+    clock[0] += 60
+    assert cache.derived(senders) == "b@server.com"
+    assert cache.derived(senders) == "b@server.com"
+    assert cache.etag == s3_client.etag and len(s3_client.requests) == 3 and len(built) == 2
+
+
+def test_other_errors_are_raised(clock):
+    s3_client = StubS3Client({})
+    cache = S3ConfigCache(s3_client, BUCKET_NAME, CONFIG_PARSER_KEY, ttl_seconds=0)
+    cache.get()
+
+    def denied(**request):
+        raise ClientError({"Error": {"Code": "AccessDenied", "Message": "Access Denied"}}, "GetObject")
+
+    s3_client.get_object = denied
+    with pytest.raises(ClientError):
+        cache.get()
+
+
+@pytest.fixture
+def email_filtering(monkeypatch):
+    monkeypatch.setenv("BUCKET_NAME", BUCKET_NAME)
+    monkeypatch.setenv("CONFIG_PARSER_KEY", CONFIG_PARSER_KEY)
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET_NAME)
+        import email_filtering
+        monkeypatch.setattr(email_filtering, "config_cache", None)
+        monkeypatch.setattr(email_filtering, "CONFIG_CACHE_TTL_SECONDS", 0)
+        yield email_filtering
+
+
+def put_configuration(accepted_senders):
+    boto3.client("s3").put_object(Bucket=BUCKET_NAME, Key=CONFIG_PARSER_KEY, Body=json.dumps({
+        "ACCEPTED_SENDERS": accepted_senders,
+        "FILTERING_RULES": {"REJECTED_VERDICTS": {"spam": ["FAIL"]}},
+    }).encode("utf-8"))
+
+
+def ses_event(source, spam="PASS"):
+    return {"Records": [{"ses": {
+        "mail": {"source": source, "headers": [{"name": "Content-Type", "value": "multipart/mixed; boundary=abc"}]},
+        "receipt": {"spamVerdict": {"status": spam}},
+    }}]}
+
+
+def test_filtering_follows_the_configuration_in_s3(email_filtering):
+    put_configuration("server.com")
+    assert email_filtering.lambda_handler(ses_event("trusted_emails@server.com"), None) is None
+    assert email_filtering.lambda_handler(ses_event("other@email.com"), None) == {"disposition": "STOP_RULE_SET"}
+    assert email_filtering.lambda_handler(ses_event("trusted_emails@server.com", spam="FAIL"), None) \
+        == {"disposition": "STOP_RULE_SET"}
+
+    put_configuration("email.com")
+    assert email_filtering.lambda_handler(ses_event("other@email.com"), None) is None
+    assert email_filtering.lambda_handler(ses_event("trusted_emails@server.com"), None) \
+        == {"disposition": "STOP_RULE_SET"}
@@ -0,0 +1,43 @@
+import boto3
+import pandas as pd
+import pytest
+from moto import mock_aws
+
+BUCKET_NAME = "email-integration-test"
+DIRECTORY = "curated_emails/orders-csv/email_received_date=20210111"
+
+
+@pytest.fixture
+def curated_compaction(monkeypatch):
+    monkeypatch.setenv("BUCKET_NAME", BUCKET_NAME)
+    monkeypatch.setenv("S3_PREFIX_CURATED", "curated_emails")
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET_NAME)
+        import curated_compaction
+        monkeypatch.setattr(curated_compaction, "COMPACTION_MIN_FILE_AGE_MINUTES", 0)
+        yield curated_compaction
+
+
+def keys():
+    response = boto3.client("s3").list_objects_v2(Bucket=BUCKET_NAME, Prefix=f"{DIRECTORY}/")
+    return sorted(s3_object["Key"].split("/")[-1] for s3_object in response.get("Contents", []))
+
+
+def test_interrupted_compaction_is_finished_by_the_next_run(curated_compaction, monkeypatch):
+    import awswrangler as wr
+    for index in range(3):
+        wr.s3.to_parquet(df=pd.DataFrame({"id": [index]}), path=f"s3://{BUCKET_NAME}/{DIRECTORY}/{index}.parquet")
+
+    def interrupted(bucket_name, manifest_key, manifest):
+        raise TimeoutError("Task timed out")
+
+    delete_sources = curated_compaction.delete_sources
+    monkeypatch.setattr(curated_compaction, "delete_sources", interrupted)
+    assert curated_compaction.lambda_handler({}, None) == {"compacted_files": 0}
+    assert len(keys()) == 5 and any(key.startswith("_compaction-") for key in keys())
+    monkeypatch.setattr(curated_compaction, "delete_sources", delete_sources)
+
+    # the sources of the merged file are deleted, they are not compacted a second time
+    assert curated_compaction.lambda_handler({}, None) == {"compacted_files": 0}
+    assert len(keys()) == 1 and keys()[0].startswith("compacted-")
+    assert sorted(wr.s3.read_parquet(path=f"s3://{BUCKET_NAME}/{DIRECTORY}/")["id"]) == [0, 1, 2]
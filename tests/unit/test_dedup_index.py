@@ -0,0 +1,24 @@
+import io
+
+import pytest
+
+from dedup_index import MemoryDedupIndex, SqliteDedupIndex, content_digest, dedup_key
+
+
+@pytest.mark.parametrize("index", [MemoryDedupIndex(), SqliteDedupIndex()])
+def test_marked_key_is_seen(index):
+    key = dedup_key(content_digest(io.BytesIO(b"a,b\n1,2\n")), "Sender@Server.com", "data-csv")
+    assert not index.seen(key)
+    index.mark(key)
+    index.mark(key)
+    assert index.seen(key)
+
+
+def test_key_depends_on_content_sender_and_table():
+    content = io.BytesIO(b"a,b\n1,2\n")
+    digest = content_digest(content)
+    assert content.tell() == 0
+    assert dedup_key(digest, "sender@server.com", "data-csv") == dedup_key(digest, "SENDER@server.com", "data-csv")
+    assert dedup_key(digest, "sender@server.com", "data-csv") != dedup_key(digest, "other@server.com", "data-csv")
+    assert dedup_key(digest, "sender@server.com", "data-csv") != dedup_key(digest, "sender@server.com", "other-csv")
+    assert digest != content_digest(io.BytesIO(b"a,b\n1,3\n"))
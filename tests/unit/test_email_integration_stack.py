@@ -1,4 +1,4 @@
-from aws_cdk import core
+from aws_cdk import App
 from email_integration.email_integration_stack import EmailIntegrationStack
 from aws_cdk.assertions import Template, Match
 
@@ -17,7 +17,7 @@ TESTING_CONTEXT = {
 
 
 def get_template():
-    app = core.App(
+    app = App(
         context=TESTING_CONTEXT
     )
     return Template.from_stack(EmailIntegrationStack(app, "cdk-email-integration"))
@@ -39,7 +39,44 @@ def test_ses_rule_set():
             ]),
 
             "Enabled": True,
+            "ScanEnabled": True,
             "Recipients": Match.any_value()
         },
     }
     my_cdk_template.has_resource_properties("AWS::SES::ReceiptRule", expected)
+
+
+def test_curated_compaction_schedule():
+    my_cdk_template.has_resource_properties("AWS::Events::Rule", {
+        "ScheduleExpression": "rate(1 day)",
+        "State": "ENABLED"
+    })
+
+
+def test_raw_emails_are_buffered_in_sqs():
+    my_cdk_template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 10,
+        "MaximumBatchingWindowInSeconds": 5,
+        "FunctionResponseTypes": ["ReportBatchItemFailures"],
+        "ScalingConfig": {"MaximumConcurrency": 5}
+    })
+    my_cdk_template.has_resource_properties("AWS::SQS::Queue", {
+        "VisibilityTimeout": 1800,
+        "RedrivePolicy": Match.object_like({"maxReceiveCount": 3})
+    })
+
+
+def test_emails_are_routed_to_sized_processors():
+    for memory_size, timeout in ((512, 300), (2048, 600), (8192, 900)):
+        my_cdk_template.has_resource_properties("AWS::Lambda::Function", {
+            "ImageConfig": {"Command": ["email_processing.lambda_handler"]},
+            "MemorySize": memory_size,
+            "Timeout": timeout
+        })
+    my_cdk_template.has_resource_properties("AWS::Lambda::Function", {
+        "ImageConfig": {"Command": ["email_routing.lambda_handler"]},
+        "Environment": {"Variables": Match.object_like({
+            "SMALL_MAX_EMAIL_BYTES": str(5 * 1024 * 1024),
+            "PROCESSING_QUEUE_LARGE_URL": Match.any_value()
+        })}
+    })
@@ -0,0 +1,293 @@
+import json
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import boto3
+import pytest
+from moto import mock_aws
+
+BUCKET_NAME = "email-integration-test"
+DATABASE_NAME = "database_email_integration"
+SENDER = "trusted_emails@server.com"
+
+
+@pytest.fixture
+def email_processing(monkeypatch):
+    monkeypatch.setenv("GLUE_DATABASE_NAME", DATABASE_NAME)
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        boto3.client("glue").create_database(DatabaseInput={"Name": DATABASE_NAME})
+        s3_client.put_object(Bucket=BUCKET_NAME, Key="config/email.json", Body=json.dumps({
+            "S3_PREFIX_QUARANTINE": "quarantine_email",
+            "S3_PREFIX_CURATED": "curated_emails",
+        }).encode("utf-8"))
+        import email_processing
+        for cache in (email_processing.config_caches, email_processing.catalog_caches,
+                      email_processing.dedup_indexes, email_processing.inferred_schemas):
+            cache.clear()
+        yield email_processing
+
+
+def put_email(key, attachments, date="Mon, 11 Jan 2021 08:29:38 +0000"):
+    message = MIMEMultipart()
+    message["From"] = SENDER
+    message["To"] = "email_you_own@server.com"
+    if date is not None:
+        message["Date"] = date
+    message.attach(MIMEText("Please find the files attached"))
+    for filename, payload in attachments:
+        part = MIMEApplication(payload, "octet-stream")
+        part.add_header("Content-Disposition", "attachment", filename=filename)
+        message.attach(part)
+    boto3.client("s3").put_object(Bucket=BUCKET_NAME, Key=key, Body=message.as_bytes())
+    return {"s3": {"bucket": {"name": BUCKET_NAME}, "object": {"key": key}}}
+
+
+def keys(prefix):
+    response = boto3.client("s3").list_objects_v2(Bucket=BUCKET_NAME, Prefix=prefix)
+    return sorted(s3_object["Key"] for s3_object in response.get("Contents", []))
+
+
+def curated_rows(table):
+    import awswrangler as wr
+    return wr.s3.read_parquet(path=f"s3://{BUCKET_NAME}/curated_emails/{table}/", dataset=True)
+
+
+def parquet_type(key, column):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    parquet_file = boto3.client("s3").get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
+    return str(pq.read_schema(pa.BufferReader(parquet_file)).field(column).type)
+
+
+def glue_columns(table):
+    table = boto3.client("glue").get_table(DatabaseName=DATABASE_NAME, Name=table)["Table"]
+    return {column["Name"]: column["Type"] for column in table["StorageDescriptor"]["Columns"]}
+
+
+def test_attachments_are_pushed_in_curated_once(email_processing):
+    record = put_email("tooling/first", [("orders.csv", b"id,label\n1,a\n2,b\n")])
+    email_processing.lambda_handler({"Records": [record]}, None)
+    rows = curated_rows("orders-csv")
+    assert list(rows["id"]) == [1, 2] and set(rows["email_received_date"]) == {"20210111"}
+    assert glue_columns("orders_csv") == {"id": "bigint", "label": "string"}
+    assert keys("original_curated_emails/") and not keys("quarantine_email/")
+
+    # the same attachment in another email is skipped by the dedup index
+    email_processing.lambda_handler({"Records": [put_email("tooling/second", [("orders.csv",
+                                                                                b"id,label\n1,a\n2,b\n")])]}, None)
+    assert len(curated_rows("orders-csv")) == 2
+
+
+def test_unknown_extension_is_quarantined(email_processing, caplog):
+    email_processing.lambda_handler({"Records": [put_email("tooling/pdf", [("report.pdf", b"%PDF-1.4")])]}, None)
+    email_processing.lambda_handler({"Records": [put_email("tooling/other_pdf", [("report.pdf", b"%PDF-1.5")])]},
+                                    None)
+    # each quarantined email keeps the manifest of its own attachment
+    assert keys("quarantine_email/") == ["quarantine_email/attachment/other-pdf/report-pdf.json",
+                                         "quarantine_email/attachment/pdf/report-pdf.json",
+                                         "quarantine_email/emails/other-pdf", "quarantine_email/emails/pdf"]
+    manifest = json.loads(boto3.client("s3").get_object(
+        Bucket=BUCKET_NAME, Key="quarantine_email/attachment/pdf/report-pdf.json")["Body"].read())
+    assert manifest["reason"] == "UnknownExtension" and manifest["part_index"] == 2
+    assert manifest["email"] == {"bucket": BUCKET_NAME, "key": "quarantine_email/emails/pdf"}
+    assert not keys("curated_emails/")
+    assert "notify team with error UnknownExtension" in caplog.text
+
+
+def test_emails_that_can_not_be_loaded_go_back_to_the_queue(email_processing):
+    loaded = put_email("tooling/loaded", [("orders.csv", b"id\n1\n")])
+    missing = {"s3": {"bucket": {"name": BUCKET_NAME}, "object": {"key": "tooling/missing"}}}
+    event = {"Records": [{"eventSource": "aws:sqs", "messageId": message_id, "body": json.dumps({"Records": [record]})}
+                         for message_id, record in (("loaded", loaded), ("missing", missing))]}
+    assert email_processing.lambda_handler(event, None) == {"batchItemFailures": [{"itemIdentifier": "missing"}]}
+    assert len(curated_rows("orders-csv")) == 1
+
+
+def test_throttled_emails_go_back_to_the_queue(email_processing, monkeypatch):
+    from botocore.exceptions import ClientError
+
+    def throttled(database, table):
+        raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "GetTable")
+
+    monkeypatch.setattr(email_processing, "get_glue_table", throttled)
+    record = put_email("tooling/throttled", [("orders.csv", b"id\n1\n")])
+    event = {"Records": [{"eventSource": "aws:sqs", "messageId": "throttled",
+                          "body": json.dumps({"Records": [record]})}]}
+    assert email_processing.lambda_handler(event, None) == {"batchItemFailures": [{"itemIdentifier": "throttled"}]}
+    assert not keys("quarantine_email/") and not keys("curated_emails/")
+
+
+def test_types_drifting_across_chunks(email_processing, monkeypatch):
+    monkeypatch.setattr(email_processing, "CSV_CHUNK_ROWS", 100)
+    drifting = "v\n" + "".join(f"{row}\n" for row in range(150)) + "".join(f"x{row}\n" for row in range(150, 250))
+    email_processing.lambda_handler({"Records": [put_email("tooling/drift", [("drift.csv", drifting.encode())])]},
+                                    None)
+    assert glue_columns("drift_csv")["v"] == "string"
+    assert {parquet_type(key, "v") for key in keys("curated_emails/drift-csv/")} == {"string"}
+    assert sorted(curated_rows("drift-csv")["v"]) == sorted(drifting.split()[1:])
+
+    # the schema cached from integers does not fit a file turning to text at its second chunk: that file
+    # conflicts with the bigint table and is quarantined before any of its rows is written
+    integers = "v\n" + "".join(f"{row}\n" for row in range(250))
+    email_processing.lambda_handler({"Records": [put_email("tooling/integers", [("ints.csv", integers.encode())])]},
+                                    None)
+    files = keys("curated_emails/ints-csv/")
+    email_processing.lambda_handler({"Records": [put_email("tooling/text", [("ints.csv", drifting.encode())])]},
+                                    None)
+    assert keys("curated_emails/ints-csv/") == files and len(curated_rows("ints-csv")) == 250
+    assert glue_columns("ints_csv")["v"] == "bigint"
+    assert "quarantine_email/attachment/text/ints-csv.json" in keys("quarantine_email/")
+
+
+def test_tables_partitioned_otherwise_are_not_appended(email_processing, monkeypatch):
+    monkeypatch.setattr(email_processing, "CURATED_PARTITIONING", False)
+    email_processing.lambda_handler({"Records": [put_email("tooling/before", [("orders.csv", b"id\n1\n")])]}, None)
+    files = keys("curated_emails/orders-csv/")
+    monkeypatch.setattr(email_processing, "CURATED_PARTITIONING", True)
+    email_processing.lambda_handler({"Records": [put_email("tooling/after", [("orders.csv", b"id\n2\n")])]}, None)
+    assert keys("curated_emails/orders-csv/") == files
+    assert "quarantine_email/attachment/after/orders-csv.json" in keys("quarantine_email/")
+
+
+def test_appends_are_cast_to_the_wider_types_of_the_table(email_processing):
+    drifting = "v\n1\nx2\n"
+    email_processing.lambda_handler({"Records": [put_email("tooling/text", [("codes.csv", drifting.encode())])]},
+                                    None)
+    # a cold container infers integers from the next file, they fit the string column of the table
+    for cache in (email_processing.catalog_caches, email_processing.inferred_schemas):
+        cache.clear()
+    for key in ("tooling/integers", "tooling/more_integers"):
+        email_processing.lambda_handler({"Records": [put_email(key, [("codes.csv", f"v\n{len(key)}\n".encode())])]},
+                                        None)
+    assert {parquet_type(key, "v") for key in keys("curated_emails/codes-csv/")} == {"string"}
+    assert sorted(curated_rows("codes-csv")["v"]) == ["1", "16", "21", "x2"]
+    assert not keys("quarantine_email/")
+
+
+def test_arrow_engine_reads_types_drifting_after_the_first_block(email_processing, monkeypatch):
+    monkeypatch.setattr(email_processing, "CSV_ENGINE", "arrow")
+    monkeypatch.setattr(email_processing, "CSV_CHUNK_ROWS", 50000)
+    drifting = "v\n" + "".join(f"{row}\n" for row in range(250000)) + "".join(f"x{row}\n" for row in range(50000))
+    email_processing.lambda_handler({"Records": [put_email("tooling/arrow", [("arrow.csv", drifting.encode())])]},
+                                    None)
+    assert glue_columns("arrow_csv")["v"] == "string"
+    assert {parquet_type(key, "v") for key in keys("curated_emails/arrow-csv/")} == {"string"}
+    assert len(curated_rows("arrow-csv")) == 300000 and not keys("quarantine_email/")
+
+    # the next file conflicts with the table: the catalog is checked before its data file is written
+    files = keys("curated_emails/arrow-csv/")
+    monkeypatch.setattr(email_processing, "CURATED_PARTITION_BY_SENDER", True)
+    email_processing.lambda_handler({"Records": [put_email("tooling/arrow_partitioned",
+                                                           [("arrow.csv", b"v\n1\n")])]}, None)
+    assert keys("curated_emails/arrow-csv/") == files
+    assert "quarantine_email/attachment/arrow-partitioned/arrow-csv.json" in keys("quarantine_email/")
+
+
+def test_file_read_at_once_that_does_not_fit_the_cached_schema(email_processing, monkeypatch):
+    monkeypatch.setattr(email_processing, "CSV_CHUNK_ROWS", 0)
+    email_processing.lambda_handler({"Records": [put_email("tooling/integers", [("codes.csv", b"v,w\n1,2\n")])]},
+                                    None)
+    email_processing.lambda_handler({"Records": [put_email("tooling/floats", [("codes.csv", b"v,w\n1.5,3\n")])]},
+                                    None)
+    # inferred again as double, which the bigint column can not hold
+    assert list(curated_rows("codes-csv")["v"]) == [1]
+    assert "quarantine_email/attachment/floats/codes-csv.json" in keys("quarantine_email/")
+
+
+@pytest.mark.parametrize("dedup_backend", ["s3", "none"])
+@pytest.mark.parametrize("failing_step, failing_call", [("push_attachment_in_curated", 2),
+                                                        ("push_original_attachment", 1)])
+def test_retried_emails_do_not_append_their_rows_twice(email_processing, monkeypatch, dedup_backend, failing_step,
+                                                       failing_call):
+    from botocore.exceptions import ClientError
+    monkeypatch.setattr(email_processing, "DEDUP_BACKEND", dedup_backend)
+    monkeypatch.setattr(email_processing, "CSV_CHUNK_ROWS", 100)
+    step = getattr(email_processing.AttachmentParserInstance, failing_step)
+    calls = []
+
+    def throttled_once(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == failing_call:
+            raise ClientError({"Error": {"Code": "SlowDown", "Message": "Please reduce your request rate"}},
+                              "PutObject")
+        return step(*args, **kwargs)
+
+    monkeypatch.setattr(email_processing.AttachmentParserInstance, failing_step, throttled_once)
+    record = put_email("tooling/retried", [("orders.csv", ("id\n" + "".join(f"{row}\n" for row in range(250)))
+                                            .encode())])
+    event = {"Records": [{"eventSource": "aws:sqs", "messageId": "retried", "body": json.dumps({"Records": [record]})}]}
+    assert email_processing.lambda_handler(event, None) == {"batchItemFailures": [{"itemIdentifier": "retried"}]}
+    assert email_processing.lambda_handler(event, None) == {"batchItemFailures": []}
+    assert sorted(curated_rows("orders-csv")["id"]) == list(range(250))
+    assert len(keys("curated_emails/orders-csv/")) == 3
+
+
+def test_declared_integers_overflowing_in_a_later_chunk_are_nulls(email_processing, monkeypatch):
+    monkeypatch.setattr(email_processing, "CSV_CHUNK_ROWS", 100)
+    boto3.client("s3").put_object(Bucket=BUCKET_NAME, Key="config/email.json", Body=json.dumps({
+        "S3_PREFIX_QUARANTINE": "quarantine_email",
+        "S3_PREFIX_CURATED": "curated_emails",
+        "NORMALIZATION": {"TABLES": {"levels_csv": {"columns": {"level": {"type": "int8"}}}}},
+    }).encode("utf-8"))
+    levels = "level\n" + "".join(f"{row}\n" for row in range(150))
+    email_processing.lambda_handler({"Records": [put_email("tooling/levels", [("levels.csv", levels.encode())])]},
+                                    None)
+    rows = curated_rows("levels-csv")
+    assert len(rows) == 150 and sorted(rows["level"].dropna()) == list(range(128))
+    assert glue_columns("levels_csv")["level"] == "tinyint" and not keys("quarantine_email/")
+
+
+def workbook(sheets):
+    import io
+    import openpyxl
+    book = openpyxl.Workbook()
+    book.remove(book.active)
+    for title, rows in sheets.items():
+        sheet = book.create_sheet(title)
+        for row in rows:
+            sheet.append(row)
+    content = io.BytesIO()
+    book.save(content)
+    return content.getvalue()
+
+
+def test_sheets_are_checked_against_the_catalog_before_any_is_written(email_processing):
+    email_processing.lambda_handler({"Records": [put_email("tooling/book", [("book.xlsx", workbook(
+        {"First": [("id",), (1,), (2,)], "Second": [("v",), (1,)]}))])]}, None)
+    files = keys("curated_emails/")
+    # the second sheet turns to text, which its bigint table can not hold: the first sheet is not appended either
+    email_processing.lambda_handler({"Records": [put_email("tooling/drifting_book", [("book.xlsx", workbook(
+        {"First": [("id",), (3,)], "Second": [("v",), ("x",)]}))])]}, None)
+    assert keys("curated_emails/") == files and len(curated_rows("book-xlsx")) == 2
+    assert "quarantine_email/attachment/drifting-book/book-xlsx.json" in keys("quarantine_email/")
+
+
+@pytest.mark.parametrize("date", [None, "not a date"])
+def test_emails_without_a_valid_date_are_partitioned_by_their_s3_event_time(email_processing, date):
+    record = put_email("tooling/undated", [("orders.csv", b"id\n1\n")], date=date)
+    email_processing.lambda_handler({"Records": [{**record, "eventTime": "2021-03-04T23:59:59.000Z"}]}, None)
+    assert set(curated_rows("orders-csv")["email_received_date"]) == {"20210304"}
+
+    # without an event time in the record, the time the email was written in S3
+    import datetime
+    email_processing.lambda_handler({"Records": [put_email("tooling/undated_replay", [("other.csv", b"id\n1\n")],
+                                                           date=date)]}, None)
+    today = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d")
+    assert set(curated_rows("other-csv")["email_received_date"]) == {today}
+
+
+def test_both_csv_engines_keep_the_text_of_dates_and_times(email_processing, monkeypatch):
+    moments = "day,moment,fraction\n2021-01-11,2021-01-11T07:29:38Z,2021-01-11 07:29:38.5\n" \
+              "2021-01-12,2021-01-12T08:00:00Z,2021-01-12 08:00:00.25\n"
+    email_processing.lambda_handler({"Records": [put_email("tooling/pandas", [("pandas.csv", moments.encode())])]},
+                                    None)
+    monkeypatch.setattr(email_processing, "CSV_ENGINE", "arrow")
+    email_processing.lambda_handler({"Records": [put_email("tooling/arrow", [("arrow.csv", moments.encode())])]},
+                                    None)
+    columns = ["day", "moment", "fraction"]
+    assert curated_rows("arrow-csv")[columns].values.tolist() == curated_rows("pandas-csv")[columns].values.tolist() \
+        == [row.split(",") for row in moments.splitlines()[1:]]
+    assert glue_columns("arrow_csv") == glue_columns("pandas_csv")
@@ -0,0 +1,122 @@
+import json
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+
+import boto3
+import pytest
+from moto import mock_aws
+
+BUCKET_NAME = "email-integration-test"
+TIERS = ("small", "medium", "large")
+
+
+@pytest.fixture
+def email_routing(monkeypatch):
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET_NAME)
+        sqs_client = boto3.client("sqs")
+        for tier in TIERS:
+            monkeypatch.setenv(f"PROCESSING_QUEUE_{tier.upper()}_URL",
+                               sqs_client.create_queue(QueueName=f"processing-{tier}")["QueueUrl"])
+        import email_routing
+        yield email_routing
+
+
+def put_email(key, filename, payload):
+    message = MIMEMultipart()
+    message["From"] = "trusted_emails@server.com"
+    part = MIMEApplication(payload, "octet-stream")
+    part.add_header("Content-Disposition", "attachment", filename=filename)
+    message.attach(part)
+    raw_email = message.as_bytes()
+    boto3.client("s3").put_object(Bucket=BUCKET_NAME, Key=key, Body=raw_email)
+    return len(raw_email)
+
+
+def message(message_id, key, size=None):
+    s3_object = {"key": key} if size is None else {"key": key, "size": size}
+    return {"messageId": message_id, "eventSource": "aws:sqs",
+            "body": json.dumps({"Records": [{"s3": {"bucket": {"name": BUCKET_NAME}, "object": s3_object}}]})}
+
+
+def routed_message_ids():
+    sqs_client = boto3.client("sqs")
+    routed = {}
+    for tier in TIERS:
+        queue_url = sqs_client.get_queue_url(QueueName=f"processing-{tier}")["QueueUrl"]
+        while True:
+            messages = sqs_client.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10).get("Messages", [])
+            if not messages:
+                break
+            for sqs_message in messages:
+                s3_object = json.loads(sqs_message["Body"])["Records"][0]["s3"]["object"]
+                routed[s3_object["key"]] = tier
+                sqs_client.delete_message(QueueUrl=queue_url, ReceiptHandle=sqs_message["ReceiptHandle"])
+    return routed
+
+
+def test_emails_are_routed_by_size_and_workbooks(email_routing, monkeypatch):
+    csv_size = put_email("tooling/orders", "orders.csv", b"id\n1\n" * 100)
+    workbook_size = put_email("tooling/book", "book.xlsx", b"PK" * 250)
+    large_size = put_email("tooling/archive", "archive.xlsx", b"PK" * 5000)
+    # the workbook is small on its own, but not once weighted by WORKBOOK_SIZE_FACTOR
+    monkeypatch.setattr(email_routing, "SMALL_MAX_EMAIL_BYTES", max(csv_size, workbook_size))
+    monkeypatch.setattr(email_routing, "MEDIUM_MAX_EMAIL_BYTES", large_size - 1)
+    put_email("tooling/raw emails/book+1", "book.xlsx", b"PK" * 250)
+    event = {"Records": [message("orders", "tooling/orders", csv_size),
+                         message("book", "tooling/book", workbook_size),
+                         message("archive", "tooling/archive", large_size),
+                         # keys are url encoded, and the size is read from S3 when the record has none
+                         message("encoded", "tooling/raw+emails/book%2B1")]}
+    assert email_routing.lambda_handler(event, None) == {"batchItemFailures": []}
+    assert routed_message_ids() == {"tooling/orders": "small", "tooling/book": "medium", "tooling/archive": "large",
+                                    "tooling/raw+emails/book%2B1": "medium"}
+
+    monkeypatch.setattr(email_routing, "WORKBOOK_SIZE_FACTOR", 1)
+    assert email_routing.lambda_handler({"Records": [message("book", "tooling/book", workbook_size)]}, None) \
+        == {"batchItemFailures": []}
+    assert routed_message_ids() == {"tooling/book": "small"}
+
+
+def test_messages_are_forwarded_by_batches_of_ten(email_routing, monkeypatch):
+    size = put_email("tooling/orders", "orders.csv", b"id\n1\n")
+    send_message_batch = email_routing.sqs_client.send_message_batch
+    batch_sizes = []
+
+    def counted_send_message_batch(**kwargs):
+        batch_sizes.append(len(kwargs["Entries"]))
+        return send_message_batch(**kwargs)
+
+    monkeypatch.setattr(email_routing.sqs_client, "send_message_batch", counted_send_message_batch)
+    event = {"Records": [message(f"message-{index}", "tooling/orders", size) for index in range(23)]}
+    assert email_routing.lambda_handler(event, None) == {"batchItemFailures": []}
+    assert batch_sizes == [10, 10, 3]
+    sqs_client = boto3.client("sqs")
+    queue_url = sqs_client.get_queue_url(QueueName="processing-small")["QueueUrl"]
+    assert sqs_client.get_queue_attributes(QueueUrl=queue_url, AttributeNames=["ApproximateNumberOfMessages"])[
+        "Attributes"]["ApproximateNumberOfMessages"] == "23"
+
+
+def test_failed_messages_are_reported(email_routing, monkeypatch):
+    size = put_email("tooling/orders", "orders.csv", b"id\n1\n")
+    monkeypatch.setattr(email_routing, "MEDIUM_MAX_EMAIL_BYTES", size)
+    monkeypatch.setattr(email_routing, "SMALL_MAX_EMAIL_BYTES", size - 1)
+    send_message_batch = email_routing.sqs_client.send_message_batch
+
+    def partly_failed_send_message_batch(**kwargs):
+        response = send_message_batch(**kwargs)
+        if kwargs["QueueUrl"].endswith("processing-small"):
+            response["Failed"] = [{"Id": "rejected", "SenderFault": False, "Code": "InternalError"}]
+        return response
+
+    monkeypatch.setattr(email_routing.sqs_client, "send_message_batch", partly_failed_send_message_batch)
+    monkeypatch.setenv("PROCESSING_QUEUE_MEDIUM_URL", "https://sqs.us-east-1.amazonaws.com/123456789012/missing")
+    event = {"Records": [message("rejected", "tooling/orders", 10),
+                         message("accepted", "tooling/orders", 20),
+                         # the medium queue does not exist, the whole batch fails
+                         message("unsent", "tooling/orders", size),
+                         # the email does not exist, its size can not be read
+                         message("missing", "tooling/missing"),
+                         {"messageId": "test-event", "body": json.dumps({"Event": "s3:TestEvent"})}]}
+    assert email_routing.lambda_handler(event, None) == {
+        "batchItemFailures": [{"itemIdentifier": message_id} for message_id in ("missing", "rejected", "unsent")]}
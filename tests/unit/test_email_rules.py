@@ -0,0 +1,29 @@
+from email_rules import FilteringRules
+
+
+def ses_event(content_type="multipart/mixed; boundary=abc", **verdicts):
+    return {
+        "mail": {"source": "trusted_emails@server.com",
+                 "headers": [{"name": "From", "value": "trusted_emails@server.com"},
+                             {"name": "Content-Type", "value": content_type}]},
+        "receipt": {f"{verdict}Verdict": {"status": status} for verdict, status in verdicts.items()},
+    }
+
+
+def test_default_rules():
+    rules = FilteringRules.from_config({})
+    assert rules.rejection_reason(ses_event(spam="PASS", virus="PASS", spf="FAIL")) is None
+    assert rules.rejection_reason(ses_event(spam="FAIL")) == "spamVerdict_FAIL"
+    assert rules.rejection_reason(ses_event(virus="FAIL")) == "virusVerdict_FAIL"
+    assert rules.rejection_reason(ses_event("text/plain; charset=utf-8")) == "no_attachment_text/plain"
+    assert rules.rejection_reason(ses_event("application/vnd.ms-excel")) is None
+    assert rules.rejection_reason(ses_event("text/html; charset=utf-8")) == "no_attachment_text/html"
+    for content_type in ("multipart/alternative", "multipart/signed", "multipart/related"):
+        assert rules.rejection_reason(ses_event(f"{content_type}; boundary=abc")) is None
+
+
+def test_configured_rules():
+    rules = FilteringRules.from_config({"FILTERING_RULES": {"REJECTED_VERDICTS": {"spf": ["FAIL", "GRAY"]},
+                                                            "ATTACHMENT_CONTENT_TYPES": []}})
+    assert rules.rejection_reason(ses_event(spf="gray")) == "spfVerdict_GRAY"
+    assert rules.rejection_reason(ses_event("text/plain", spam="FAIL")) is None
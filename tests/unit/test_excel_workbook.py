@@ -0,0 +1,76 @@
+import io
+import re
+import zipfile
+
+import openpyxl
+import pytest
+
+from excel_workbook import iter_sheet_chunks, open_workbook, workbook_size_error
+
+
+def workbook_content(sheets):
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for title, rows in sheets.items():
+        worksheet = workbook.create_sheet(title)
+        for row in rows:
+            worksheet.append(row)
+    content = io.BytesIO()
+    workbook.save(content)
+    return content
+
+
+def without_dimensions(content):
+    """Same workbook without the <dimension> of its sheets, as some exporters write them"""
+    output = io.BytesIO()
+    with zipfile.ZipFile(content) as source, zipfile.ZipFile(output, "w") as archive:
+        for member in source.infolist():
+            data = source.read(member.filename)
+            if member.filename.startswith("xl/worksheets/"):
+                data = re.sub(rb"<dimension[^>]*/>", b"", data)
+            archive.writestr(member, data)
+    return output
+
+
+def test_every_sheet_is_read_in_chunks():
+    content = workbook_content({"Orders": [("id", "amount")] + [(index, index * 2) for index in range(5)],
+                                "Customers": [("name",), ("a",), (None,), ("b",)]})
+    workbook = open_workbook(content)
+    orders, customers = workbook.worksheets
+    assert [len(chunk) for chunk in iter_sheet_chunks(orders, chunk_rows=2)] == [2, 2, 1]
+    assert list(next(iter_sheet_chunks(customers, chunk_rows=0))["name"]) == ["a", "b"]
+    workbook.close()
+
+
+def test_oversized_workbooks_are_rejected():
+    content = workbook_content({"First": [("id",)] + [(index,) for index in range(10)],
+                                "Second": [("id",)] + [(index,) for index in range(10)]})
+    workbook = open_workbook(content)
+    assert workbook_size_error(workbook, content, max_rows=22, max_bytes=0) is None
+    assert "rows" in workbook_size_error(workbook, content, max_rows=21, max_bytes=0)
+    assert "bytes" in workbook_size_error(workbook, content, max_rows=0, max_bytes=100)
+    with pytest.raises(Exception, match="WorkbookTooLarge"):
+        list(iter_sheet_chunks(workbook.worksheets[0], chunk_rows=100, max_rows=5))
+    workbook.close()
+
+
+def test_sheets_without_dimension_are_counted():
+    content = without_dimensions(workbook_content({"First": [("id",)] + [(index,) for index in range(10)],
+                                                   "Second": [("id",)] + [(index,) for index in range(10)]}))
+    workbook = open_workbook(content)
+    assert workbook.worksheets[0].max_row is None
+    assert workbook_size_error(workbook, content, max_rows=22, max_bytes=0) is None
+    assert "rows" in workbook_size_error(workbook, content, max_rows=21, max_bytes=0)
+    workbook.close()
+
+
+@pytest.mark.parametrize("dimensions", [True, False])
+def test_rows_are_padded_to_the_width_of_the_sheet(dimensions):
+    content = workbook_content({"Orders": [("id", "name", "note"), (1, "a"), (2, "b", None, "extra"), (3,)]})
+    workbook = open_workbook(content if dimensions else without_dimensions(content))
+    chunk = next(iter_sheet_chunks(workbook.worksheets[0], chunk_rows=0))
+    assert list(chunk.columns) == ["id", "name", "note", "Unnamed: 3"]
+    assert chunk.notna().values.tolist() == [[True, True, False, False], [True, True, False, True],
+                                             [True, False, False, False]]
+    assert list(chunk["id"]) == [1, 2, 3] and chunk["Unnamed: 3"][1] == "extra"
+    workbook.close()
@@ -0,0 +1,30 @@
+import json
+import threading
+
+from metrics import METRICS_NAMESPACE, stage
+
+
+def test_stages_of_concurrent_threads_emit_one_record_per_line(capsys):
+    def run_stages(thread_index):
+        for stage_index in range(50):
+            with stage(f"stage-{thread_index}", table="orders-csv", chunk=stage_index):
+                pass
+
+    threads = [threading.Thread(target=run_stages, args=(thread_index,)) for thread_index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 8 * 50
+    for line in lines:
+        record = json.loads(line)
+        assert record["_aws"]["CloudWatchMetrics"] == [{
+            "Namespace": METRICS_NAMESPACE,
+            "Dimensions": [["Stage"]],
+            "Metrics": [{"Name": "Duration", "Unit": "Milliseconds"}, {"Name": "PeakMemory", "Unit": "Megabytes"}],
+        }]
+        assert record["Stage"].startswith("stage-") and record["table"] == "orders-csv"
+        assert record["Duration"] >= 0 and record["PeakMemory"] > 0
+    assert {json.loads(line)["Stage"] for line in lines} == {f"stage-{index}" for index in range(8)}
@@ -0,0 +1,47 @@
+import io
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from mime_stream import StreamedEmail
+
+
+class ChunkedBody:
+    """Stand-in for the StreamingBody of an S3 GetObject response"""
+
+    def __init__(self, raw_email):
+        self.content = io.BytesIO(raw_email)
+
+    def iter_chunks(self, chunk_size):
+        return iter(lambda: self.content.read(chunk_size), b'')
+
+
+def raw_email(attachments):
+    message = MIMEMultipart()
+    message['From'] = 'Sender <trusted_emails@server.com>'
+    message['To'] = 'email_you_own@server.com'
+    message['Date'] = 'Mon, 11 Jan 2021 08:29:38 +0100'
+    message.attach(MIMEText('Please find the files attached'))
+    for filename, payload in attachments:
+        part = MIMEApplication(payload, 'csv')
+        part['Content-Disposition'] = f'attachment; filename="{filename}"'
+        message.attach(part)
+    return message.as_bytes()
+
+
+def test_attachments_are_decoded_from_the_stream():
+    body = ChunkedBody(raw_email([('report.csv', b'id,label\n1,a\n' * 1000), ('empty.csv', b'')]))
+    streamed = StreamedEmail.from_stream(body, chunk_size=512, spool_max_size=1024)
+    assert streamed.from_[0][1] == 'trusted_emails@server.com'
+    assert str(streamed.date) == '2021-01-11 07:29:38'
+    attachments = list(streamed.attachments)
+    assert [attachment['filename'] for attachment in attachments] == ['report.csv', 'empty.csv']
+    assert attachments[0]['content'].read() == b'id,label\n1,a\n' * 1000
+    assert [attachment['size'] for attachment in attachments] == [13000, 0]
+    assert [attachment['part_index'] for attachment in attachments] == [2, 3]
+
+
+def test_encoded_word_filenames_are_decoded():
+    body = ChunkedBody(raw_email([('=?UTF-8?B?UsOpc3VsdGF0cy5jc3Y=?=', b'id\n1\n')]))
+    attachment = next(StreamedEmail.from_stream(body, chunk_size=512, spool_max_size=1024).attachments)
+    assert attachment['filename'] == 'Résultats.csv'
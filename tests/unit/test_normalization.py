@@ -0,0 +1,48 @@
+import pandas as pd
+
+from normalization import Normalization
+
+CONFIGURATION = {
+    "NORMALIZATION": {
+        "DEFAULT": {"categorical_max_ratio": 0.5},
+        "TABLES": {
+            "sales_xlsx": {
+                "downcast_floats": True,
+                "columns": {
+                    "amount": {"type": "number", "thousands": " ", "decimal": ","},
+                    "quantity": {"type": "int8"},
+                    "order_date": {"type": "date", "format": "%d/%m/%Y"},
+                    "paid": {"type": "boolean"},
+                },
+            },
+        },
+    },
+}
+
+
+def test_declared_columns_are_cast():
+    normalization = Normalization.from_config(CONFIGURATION).for_table("sales-xlsx")
+    df = normalization.apply(pd.DataFrame({
+        "Amount": ["1 234,50", "n/a", "7"],
+        "Quantity": ["1", "2", None],
+        "Order Date": ["31/01/2021", "01/02/2021", "not a date"],
+        "Paid": ["Yes", "no", ""],
+        "Rate": [0.5, 1.5, 2.5],
+    }))
+    assert list(df.columns) == ["amount", "quantity", "order_date", "paid", "rate"]
+    assert df["amount"].tolist()[0] == 1234.5 and pd.isna(df["amount"][1])
+    assert str(df["quantity"].dtype) == "Int8"
+    assert df["order_date"].tolist()[:2] == [pd.Timestamp("2021-01-31"), pd.Timestamp("2021-02-01")]
+    assert df["paid"].tolist()[:2] == [True, False]
+    assert str(df["rate"].dtype) == "float32"
+    # overflows and fractions of integer columns are nulls, as the unparsable values
+    assert normalization.apply(pd.DataFrame({"quantity": ["300", "1.5", "-128"]}))["quantity"].tolist() \
+        == [pd.NA, pd.NA, -128]
+
+
+def test_low_cardinality_strings_become_categoricals():
+    default = Normalization.from_config(CONFIGURATION).for_table("other-csv")
+    df = default.apply(pd.DataFrame({"country": pd.array(["FR", "FR", "US", "FR"], dtype="string"),
+                                     "id": pd.array(["a", "b", "c", "d"], dtype="string")}))
+    assert str(df["country"].dtype) == "category"
+    assert str(df["id"].dtype) == "string"
@@ -0,0 +1,47 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import s3_tagging
+from s3_tagging import tag_objects
+
+
+class StubS3Client:
+    """Fails the tagging of every key `failures[key]` times with the given error code before succeeding"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+
+    def put_object_tagging(self, Bucket, Key, Tagging):
+        self.calls.append(Key)
+        attempts = self.calls.count(Key)
+        code, count = self.failures.get(Key, (None, 0))
+        if attempts <= count:
+            raise ClientError({"Error": {"Code": code, "Message": code}}, "PutObjectTagging")
+        assert Tagging == {"TagSet": [{"Key": "Project", "Value": "EmailIntegration"}]}
+        return {}
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    delays = []
+    monkeypatch.setattr(s3_tagging.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(s3_tagging.time, "sleep", delays.append)
+    return delays
+
+
+def test_objects_are_tagged_after_retries(delays):
+    s3_client = StubS3Client({"written": ("NoSuchKey", 2), "throttled": ("SlowDown", 1)})
+    assert tag_objects(s3_client, "bucket", ["written", "throttled", "tagged"], max_workers=1, base_delay=0.1) == []
+    assert sorted(s3_client.calls) == ["tagged", "throttled", "throttled", "written", "written", "written"]
+    # exponential backoff, the jitter draws up to the doubled delay
+    assert sorted(delays) == pytest.approx([0.1, 0.1, 0.2])
+
+
+def test_keys_that_can_not_be_tagged_are_returned(delays):
+    s3_client = StubS3Client({"deleted": ("NoSuchKey", 10), "denied": ("AccessDenied", 10)})
+    assert sorted(tag_objects(s3_client, "bucket", ["deleted", "denied", "tagged"], max_attempts=3)) \
+        == ["deleted", "denied"]
+    # errors that are not retryable fail at once
+    assert s3_client.calls.count("deleted") == 3 and s3_client.calls.count("denied") == 1
+    assert tag_objects(s3_client, "bucket", []) == []
@@ -0,0 +1,19 @@
+from sender_allow_list import SenderAllowList
+
+
+def test_exact_address_match():
+    allow_list = SenderAllowList.from_config({"ACCEPTED_SENDERS": "trusted_emails@server.com,emailtest2@email.com"})
+    assert allow_list.is_accepted("Trusted_Emails@Server.com")
+    assert allow_list.is_accepted("Partner <emailtest2@email.com>")
+    assert not allow_list.is_accepted("other@server.com")
+    assert not allow_list.is_accepted("xtrusted_emails@server.com")
+
+
+def test_domain_and_wildcard_match():
+    allow_list = SenderAllowList(["partner.com", "@supplier.org", "*.group.net"])
+    assert allow_list.is_accepted("anyone@partner.com")
+    assert allow_list.is_accepted("anyone@supplier.org")
+    assert allow_list.is_accepted("anyone@eu.mail.group.net")
+    assert not allow_list.is_accepted("anyone@group.net")
+    assert not allow_list.is_accepted("anyone@notpartner.com")
+    assert not allow_list.is_accepted("")